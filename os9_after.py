@@ -20,45 +20,489 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+
 # OS-9/68000 easy-to-read filter for IDA 6.9 (old!)
 # run this after loading OS-9/68000 Executable or makecode.
+# code ranges done are recorded in the database, and later runs only walk code made since then.
+# data referenced by a6 is made into items (sized by how it is accessed) and named.
+# syscalls fixed are recorded too, to be listed by os9calls.py.
+# if os9plan.py made a plan for the input file (FILE.os9plan), it is applied instead of walking code.
+
+import os
+import time
+import bisect
+import struct
+try:
+    import os9plan
+except ImportError:
+    os9plan = None
+try:
+    import os9calls
+except ImportError:
+    os9calls = None
+
+FULL = False # True to walk all code again, ignoring the record and the plan
+CHECK = False # True to compare the plan with walking code, changing nothing
+
+# record of code ranges already done
+NODE = "$ os9_after"
+GENERATION = 4 # bump when what the pass does changes; records of other generation are ignored.
+RECORD = struct.Struct('>II')
+LOOKAROUND = 1 # heads walked again around new code, for move/jsr pairs crossing the boundary
+
+# access width of a6 operand; 0 for instructions only taking its address (or moving many).
+WIDTHS = {idaapi.dt_byte: 1, idaapi.dt_word: 2, idaapi.dt_dword: 4}
+ADDRESSONLY = ["lea", "pea", "jsr", "jmp", "movem", "movep"]
+# making data item of width, and its name prefix
+MAKEDATA = {1: (idaapi.doByte, "gb"), 2: (idaapi.doWord, "gw"), 4: (idaapi.doDwrd, "gl")}
+
+def signed(v):
+    return v - 0x100000000 if v & 0x80000000 else v
 
-def Codes():
-    # TODO: code at 0 is ignored...
-    ea = 0
-    while True:
-        ea = idaapi.find_code(ea, idaapi.SEARCH_DOWN)
-        if ea == idaapi.BADADDR:
-            return
-        yield ea
+# what the pass needs from an instruction, taken out of idaapi.cmd (that is overwritten by next decode).
+class Insn(object):
+    __slots__ = ("ea", "size", "mnem", "a6ops", "value0", "reg1", "index0")
+
+    def __init__(self, ea, cmd):
+        self.ea = ea
+        self.size = cmd.size
+        self.mnem = cmd.get_canon_mnem()
+        # operands referencing data (a6): (operand, displacement, access width)
+        self.a6ops = [(i, signed(cmd[i].addr), 0 if self.mnem in ADDRESSONLY else WIDTHS.get(cmd[i].dtyp, 0))
+            for i in [0, 1] if cmd[i].type == idaapi.o_displ and cmd[i].reg == 14]
+        self.value0 = cmd[0].value
+        self.reg1 = cmd[1].reg
+        # it seems X in "jsr (pc,X.l)" in specflag1.
+        self.index0 = cmd[0].specflag1
 
-# idautils
 def decode(ea):
     il = idaapi.decode_insn(ea)
     if il == 0:
         raise Exception("?code but cannot decode %s" % ea)
-    return idaapi.cmd.copy()
-
-datasegea = idaapi.get_segm_by_name(".data").startEA
-for ea in Codes():
-    insn = decode(ea)
-    # reference data (a6)
-    for i in [0, 1]:
-        op = insn[i]
-        if op.type == idaapi.o_displ and op.reg == 14: #a6
-            idaapi.op_offset(ea, i, idaapi.REF_OFF32 | idaapi.REFINFO_NOBASE, idaapi.BADADDR, datasegea + 0x8000, 0)
-    # reference pcrel
-    if insn.get_canon_mnem() in ["move", "movea"]:
-        next = decode(ea + insn.size)
-        # it seems X in "jsr (pc,X.l)" in specflag1.
-        if next.get_canon_mnem() == "jsr" and next[0].specflag1 == insn[1].reg:
+    return Insn(ea, idaapi.cmd)
+
+# code heads in [start, end)
+def Codes(start, end):
+    ea = start
+    while ea != idaapi.BADADDR and ea < end:
+        if idaapi.isCode(idaapi.getFlags(ea)):
+            yield ea
+        ea = idaapi.next_head(ea, end)
+
+# sorted [(start, end)] of code done by former runs of this generation
+def loadranges():
+    node = idaapi.netnode(NODE, 0, True)
+    blob = node.getblob(0, 'B')
+    if not blob or len(blob) < RECORD.size:
+        return []
+    (generation, count) = RECORD.unpack_from(blob, 0)
+    if generation != GENERATION or len(blob) < RECORD.size * (1 + count):
+        return []
+    return [RECORD.unpack_from(blob, RECORD.size * (1 + i)) for i in range(count)]
+
+def saveranges(ranges):
+    node = idaapi.netnode(NODE, 0, True)
+    node.setblob(RECORD.pack(GENERATION, len(ranges)) + b''.join([RECORD.pack(s, e) for (s, e) in ranges]), 0, 'B')
+
+# range is still all code? (not undefined or made data since)
+def intact(start, end):
+    return (idaapi.isCode(idaapi.getFlags(start)) and idaapi.get_item_head(start) == start and
+        idaapi.find_unknown(start, idaapi.SEARCH_DOWN) >= end and idaapi.find_data(start, idaapi.SEARCH_DOWN) >= end)
+
+# any code head in [start, end)?
+def hascode(start, end):
+    if start >= end:
+        return False
+    if idaapi.isCode(idaapi.getFlags(start)):
+        return True
+    ea = idaapi.find_code(start, idaapi.SEARCH_DOWN)
+    return ea != idaapi.BADADDR and ea < end
+
+# plan unit [start, end) done by a former run: has code in recorded (intact) ranges, and no code made outside them since.
+def unitdone(start, end, kept):
+    pos = start
+    for (s, e) in kept:
+        if e <= start or end <= s:
+            continue
+        if hascode(pos, s):
+            return False
+        pos = max(pos, e)
+    return pos != start and not hascode(pos, end)
+
+# [(segment start, unit)] of the plan for the input file, None if no plan.
+def planunits():
+    if os9plan is None:
+        return None
+    path = idaapi.get_input_file_path() + os9plan.SUFFIX
+    if not os.path.exists(path):
+        return None
+    units = os9plan.read(path)
+    result = []
+    for unit in units:
+        seg = idaapi.get_segm_by_name(unit.segment)
+        if seg is not None:
+            result.append((seg.startEA, unit))
+    # a library member loaded alone is .text; find which one by opcodes.
+    seg = idaapi.get_segm_by_name(".text")
+    if not result and seg is not None:
+        for unit in units:
+            if unit.actions and unit.size <= seg.endEA - seg.startEA and all([idaapi.get_word(seg.startEA + action[0]) == action[1] for action in unit.actions]):
+                result.append((seg.startEA, unit))
+                break
+    return result
+
+def segments():
+    for n in range(idaapi.get_segm_qty()):
+        seg = idaapi.getnseg(n)
+        yield (seg.startEA, seg.endEA)
+
+# Collects rewrites while walking code (each instruction decoded once), then applies them in sorted batches.
+class Pass(object):
+    def __init__(self):
+        self.a6 = [] # (ea, operand, displacement, access width)
+        self.refs = [] # (address, access width) referenced by a6, of alive ones
+        self.bases = {} # text segment start -> a6 (None if no data)
+        self.datasegs = {} # data segment start -> end
+        self.pcrel = [] # (move ea, base, jsr target)
+        self.traps = [] # ea
+        self.calls = [] # (ea, vector, function code) of syscalls fixed
+        self.visited = {} # ea -> size
+        self.decoded = 0
+        self.kept = [] # ranges done by former runs, not walked
+        self.keptstarts = []
+
+    def decode(self, ea):
+        self.decoded += 1
+        return decode(ea)
+
+    # walk code in [start, end). if resync, stop at already visited code (after rewrite made new code).
+    def scan(self, start, end, resync=False):
+        prev = None
+        for ea in Codes(start, end):
+            if resync and self.done(ea):
+                break
+            insn = self.decode(ea)
+            self.visited[ea] = insn.size
+            if prev is not None:
+                self.pair(prev, insn if ea == prev.ea + prev.size else None)
+            self.single(insn)
+            prev = insn
+        if prev is not None:
+            self.pair(prev, None)
+
+    def done(self, ea):
+        if ea in self.visited:
+            return True
+        i = bisect.bisect_right(self.keptstarts, ea) - 1
+        return i >= 0 and ea < self.kept[i][1]
+
+    def single(self, insn):
+        # reference data (a6)
+        for (i, disp, width) in insn.a6ops:
+            self.a6.append((insn.ea, i, disp, width))
+        # os9 (trap 0)
+        if insn.mnem == "trap":
+            self.traps.append(insn.ea)
+
+    # insn and next one; next is None if not decoded yet (not a code head).
+    def pair(self, insn, next):
+        # reference pcrel
+        if insn.mnem in ["move", "movea"]:
+            if next is None:
+                next = self.decode(insn.ea + insn.size)
+            if next.mnem == "jsr" and next.index0 == insn.reg1:
+                # x is relative to pc (extension word) + d8
+                d8 = idaapi.get_byte(next.ea + 3)
+                base = next.ea + 2 + (d8 - 0x100 if d8 & 0x80 else d8)
+                self.pcrel.append((insn.ea, base, (base + insn.value0) & 0xFFFFFFFF))
+
+    # rewrites collected at heads that are gone (undefined by syscall word fix) are dropped.
+    @staticmethod
+    def alive(ea):
+        return idaapi.isCode(idaapi.getFlags(ea)) and idaapi.get_item_head(ea) == ea
+
+    # a6 is data area + 0x8000. data area is .data, or .bss if no initialized data (of the member, for library loaded as a whole).
+    def a6base(self, ea):
+        seg = idaapi.getseg(ea)
+        if seg.startEA not in self.bases:
+            name = idaapi.get_segm_name(seg) or ""
+            prefix = name[:-len(".text")] if name.endswith(".text") else ""
+            base = None
+            # both are where variables are; .data wins as the base.
+            for segname in [prefix + ".bss", prefix + ".data"]:
+                dataseg = idaapi.get_segm_by_name(segname)
+                if dataseg is not None:
+                    base = dataseg.startEA + 0x8000
+                    self.datasegs[dataseg.startEA] = dataseg.endEA
+            self.bases[seg.startEA] = base
+        return self.bases[seg.startEA]
+
+    def apply_a6(self):
+        a6 = sorted([ref for ref in self.a6 if self.alive(ref[0])])
+        for (ea, i, disp, width) in a6:
+            base = self.a6base(ea)
+            if base is None:
+                continue
+            idaapi.op_offset(ea, i, idaapi.REF_OFF32 | idaapi.REFINFO_NOBASE, idaapi.BADADDR, base, 0)
+            self.refs.append(((base + disp) & 0xFFFFFFFF, width))
+        self.a6 = []
+        return len(self.refs)
+
+    # items of data referenced, in one pass over the addresses sorted:
+    # most common access width, array of it if its address is taken too, up to next address referenced.
+    # addresses already made something are left as is.
+    def apply_data(self):
+        table = {}
+        for (addr, width) in self.refs:
+            table.setdefault(addr, []).append(width)
+        self.refs = []
+        addrs = sorted(table)
+        segstarts = sorted(self.datasegs)
+        made = 0
+        for (n, addr) in enumerate(addrs):
+            i = bisect.bisect_right(segstarts, addr) - 1
+            if i < 0 or self.datasegs[segstarts[i]] <= addr:
+                continue
+            if not idaapi.isUnknown(idaapi.getFlags(addr)):
+                continue
+            end = self.datasegs[segstarts[i]]
+            if n + 1 < len(addrs):
+                end = min(end, addrs[n + 1])
+            head = idaapi.next_head(addr, end)
+            if head != idaapi.BADADDR:
+                end = head
+            gap = end - addr
+            widths = table[addr]
+            counts = [(widths.count(w), w) for w in [1, 2, 4] if w in widths]
+            width = max(counts)[1] if counts else 0
+            if addr & 1:
+                width = min(width, 1)
+            while width > gap:
+                width //= 2
+            if width == 0:
+                (width, size) = (1, gap)
+            elif 0 in widths:
+                size = gap - gap % width
+            else:
+                size = width
+            (make, prefix) = MAKEDATA[width]
+            make(addr, size)
+            if not idaapi.has_user_name(idaapi.getFlags(addr)):
+                idaapi.set_name(addr, "%s_%X" % (prefix, addr), idaapi.SN_CHECK)
+            made += 1
+        return made
+
+    def apply_pcrel(self):
+        pcrel = sorted([(ea, base, targea) for (ea, base, targea) in self.pcrel if self.alive(ea)])
+        for (ea, base, targea) in pcrel:
             # tweak movea base
-            idaapi.op_offset(ea, 0, idaapi.REF_OFF32 | idaapi.REFINFO_NOBASE, idaapi.BADADDR, ea + 8, 0)
-            targea = insn[0].value + ea + 8
+            idaapi.op_offset(ea, 0, idaapi.REF_OFF32 | idaapi.REFINFO_NOBASE, idaapi.BADADDR, base, 0)
             #idaapi.create_insn(targea)
             idaapi.auto_mark_range(targea, targea + 1, idaapi.AU_PROC)
-    # os9 (trap 0)
-    if insn.get_canon_mnem() == "trap":
-        idaapi.do_unknown(ea + 2, idaapi.DOUNK_SIMPLE | idaapi.DOUNK_NOTRUNC)
-        idaapi.doWord(ea + 2, 2)
-        idaapi.create_insn(ea + 4)
+        self.pcrel = []
+        return len(pcrel)
+
+    # returns eas of code made after syscall words
+    def apply_traps(self):
+        made = []
+        for ea in sorted(self.traps):
+            if not self.alive(ea):
+                continue
+            idaapi.do_unknown(ea + 2, idaapi.DOUNK_SIMPLE | idaapi.DOUNK_NOTRUNC)
+            idaapi.doWord(ea + 2, 2)
+            idaapi.create_insn(ea + 4)
+            made.append(ea + 4)
+            self.calls.append((ea, idaapi.get_word(ea) & 15, idaapi.get_word(ea + 2)))
+        self.traps = []
+        return made
+
+    # ranges not done yet, widened by LOOKAROUND heads.
+    def gaps(self, segstart, segend):
+        pos = segstart
+        gaps = []
+        for (start, end) in self.kept:
+            if end <= segstart or segend <= start:
+                continue
+            if pos < start:
+                gaps.append((pos, start))
+            pos = max(pos, end)
+        if pos < segend:
+            gaps.append((pos, segend))
+        widened = []
+        for (start, end) in gaps:
+            # skip gaps having no code (data, syscall words...)
+            if not (idaapi.isCode(idaapi.getFlags(start)) and idaapi.get_item_head(start) == start):
+                start = idaapi.find_code(start, idaapi.SEARCH_DOWN)
+                if start == idaapi.BADADDR or start >= end:
+                    continue
+            for _ in range(LOOKAROUND):
+                ea = idaapi.prev_head(start, segstart)
+                if ea != idaapi.BADADDR:
+                    start = ea
+            # end is the first head of a kept range (or segment end)
+            if end < segend:
+                for _ in range(LOOKAROUND - 1):
+                    ea = idaapi.next_head(end, segend)
+                    if ea != idaapi.BADADDR:
+                        end = ea
+                end += 1
+            widened.append((start, end))
+        return widened
+
+    # contiguous code runs of what is done now and before.
+    def ranges(self):
+        runs = []
+        for ea in sorted(self.visited):
+            if not self.alive(ea):
+                continue
+            end = ea + self.visited[ea]
+            if runs and runs[-1][1] == ea:
+                runs[-1][1] = end
+            else:
+                runs.append([ea, end])
+        merged = []
+        for (start, end) in sorted([tuple(r) for r in runs] + self.kept):
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        return [tuple(r) for r in merged]
+
+    def run(self, kept=None):
+        times = []
+        t = time.time()
+        self.kept = [r for r in (kept or []) if intact(*r)]
+        self.keptstarts = [start for (start, _) in self.kept]
+        for (segstart, segend) in segments():
+            for (start, end) in self.gaps(segstart, segend):
+                self.scan(start, end)
+        times.append(("scan", time.time() - t, len(self.visited)))
+
+        t = time.time()
+        ntraps = 0
+        made = self.apply_traps()
+        while made:
+            ntraps += len(made)
+            # code after syscall words is new; walk it until it meets code already seen.
+            for ea in made:
+                self.scan(ea, idaapi.getseg(ea).endEA, True)
+            made = self.apply_traps()
+        times.append(("trap", time.time() - t, ntraps))
+
+        return times + self.apply_operands()
+
+    # syscall words first, as they change code; then operands of what is left.
+    def apply_operands(self):
+        times = []
+        for (phase, apply) in [("a6", self.apply_a6), ("data", self.apply_data), ("pcrel", self.apply_pcrel)]:
+            t = time.time()
+            n = apply()
+            times.append((phase, time.time() - t, n))
+        return times
+
+    # rewrites from the plan instead of walking code. actions at other than code heads are dropped at apply,
+    # and ones whose opcode is not in the database (stale plan) here.
+    def load(self, units):
+        for (segea, unit) in units:
+            for (off, opcode, operand, kind, target) in unit.actions:
+                ea = segea + off
+                if idaapi.get_word(ea) != opcode:
+                    continue
+                if kind == os9plan.A6:
+                    (_, ext, mode, width) = [rule for rule in os9plan.A6TABLE[opcode] if rule[0] == operand][0]
+                    d = idaapi.get_word(ea + ext)
+                    self.a6.append((ea, operand, os9plan.s16(d) if mode == 5 else os9plan.s8(d & 0xFF), width))
+                elif kind == os9plan.PCREL:
+                    base = segea + target
+                    self.pcrel.append((ea, base, (base + idaapi.get_long(ea + 2)) & 0xFFFFFFFF))
+                elif kind == os9plan.TRAP:
+                    self.traps.append(ea)
+
+    def runplan(self, units):
+        times = []
+        t = time.time()
+        self.load(units)
+        times.append(("plan", time.time() - t, len(self.a6) + len(self.pcrel) + len(self.traps)))
+
+        t = time.time()
+        ntraps = 0
+        pending = self.traps
+        # code made after syscall words may have more of them.
+        while True:
+            self.traps = [ea for ea in pending if self.alive(ea)]
+            if not self.traps:
+                break
+            applied = set(self.traps)
+            pending = [ea for ea in pending if ea not in applied]
+            ntraps += len(self.apply_traps())
+        times.append(("trap", time.time() - t, ntraps))
+        times.extend(self.apply_operands())
+
+        # code heads of the units, recorded as walking them would
+        t = time.time()
+        for (segea, unit) in units:
+            for ea in Codes(segea, segea + unit.size):
+                self.visited[ea] = idaapi.get_item_size(ea)
+        times.append(("record", time.time() - t, len(self.visited)))
+        return times
+
+# adds syscalls fixed by the pass to the index in the database, dropping ones gone.
+def savecalls(calls):
+    if os9calls is None:
+        return ""
+    index = os9calls.CallIndex.load()
+    for (ea, vector, code) in calls:
+        index.add(ea, vector, code)
+    # also ones fixed and then undone by later fix (syscall word of a trap made after it)
+    dropped = index.prune()
+    index.save()
+    return "; %d calls indexed (%d fixed, %d dropped)" % (len(index.all()), len(calls), dropped)
+
+# collects rewrites by the plan and by walking code (of units), and prints where they differ.
+def check(units):
+    walked = Pass()
+    ranges = [(segea, segea + unit.size) for (segea, unit) in units]
+    for (start, end) in ranges:
+        walked.scan(start, end)
+    planned = Pass()
+    planned.load(units)
+    same = True
+    for (phase, w, p) in [("a6", walked.a6, planned.a6), ("pcrel", walked.pcrel, planned.pcrel), ("trap", walked.traps, planned.traps)]:
+        w = set(w)
+        # apply takes only ones at code heads
+        p = set([x for x in p if Pass.alive(x if phase == "trap" else x[0])])
+        for x in sorted(w ^ p)[:20]:
+            print("os9_after: check %s: only %s: %r" % (phase, "walked" if x in w else "planned", x))
+        print("os9_after: check %s: %d walked, %d planned, %d differ" % (phase, len(w), len(p), len(w ^ p)))
+        same = same and w == p
+    return same
+
+def main():
+    start = time.time()
+    p = Pass()
+    if CHECK:
+        units = planunits()
+        if not units:
+            print("os9_after: no plan to check")
+        else:
+            print("os9_after: check %s" % ("same" if check(units) else "DIFFERENT"))
+        return
+    kept = [] if FULL else loadranges()
+    units = None if FULL else planunits()
+    if units:
+        # units done by former runs are skipped
+        p.kept = [r for r in kept if intact(*r)]
+        todo = [(segea, unit) for (segea, unit) in units if not unitdone(segea, segea + unit.size, p.kept)]
+        times = p.runplan(todo)
+        saveranges(p.ranges())
+        calls = savecalls(p.calls)
+        print("os9_after: plan of %d of %d units applied in %.3fs; %s%s" % (len(todo), len(units),
+            time.time() - start, ", ".join(["%s %.3fs (%d)" % t for t in times]), calls))
+        return
+    times = p.run(kept)
+    saveranges(p.ranges())
+    calls = savecalls(p.calls)
+    print("os9_after: %d of %d ranges kept, %d instructions, %d decodes in %.3fs; %s%s" % (len(p.kept), len(kept),
+        len(p.visited), p.decoded, time.time() - start, ", ".join(["%s %.3fs (%d)" % t for t in times]), calls))
+
+main()
@@ -0,0 +1,367 @@
+# MIT License
+#
+# Copyright (c) 2021 Murachue
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Cache of load plans: what os9rl.py / os9x.py write to the database for an object, library or module,
+# replayed as is when the same bytes are loaded again by the same loader version.
+# usage: python os9cache.py [-d DIR] info
+#        python os9cache.py [-d DIR] clear
+#
+# a plan is recorded by running the loader with its idaapi (and li) wrapped by Recorder: segments, bytes
+# (relocated images as patches to the file; file offsets are relative to what is loaded, so the same member
+# at another offset or in another library uses the same plan), fixups, items, names, comments and entries, and some loader
+# specific data (meta) for what is done after the plan (ex. lookups in os9sym/os9sig databases).
+# DIR ($OS9CACHE or ~/.os9cache) has a XX...XX.plan for each key and hit/miss counters in stats;
+# least recently used plans are removed when the total size exceeds MAXSIZE.
+# counters are kept in memory and appended to stats at exit of the process (and when plans are evicted),
+# so a hit writes nothing, and processes using the same DIR do not race rewriting stats.
+
+from __future__ import print_function
+import os
+import sys
+import zlib
+import glob
+import atexit
+import struct
+import marshal
+import hashlib
+import argparse
+
+MAGIC = b'OS9PLN02'
+MAXSIZE = 64 << 20
+STATS = struct.Struct('>QQQ') # hits, misses, evictions
+BLOCK = 16 # granularity of patches to images
+
+def defaultpath():
+	return os.environ.get("OS9CACHE") or os.path.join(os.path.expanduser("~"), ".os9cache")
+
+# idaapi functions the loaders call, by what the recorder does for them.
+WRITES = ("put_byte", "put_word", "put_long", "doByte", "doWord", "doDwrd", "set_name", "set_cmt",
+	"add_pgm_cmt", "add_entry", "add_func", "op_dec", "op_offset")
+READS = ("get_byte", "get_word", "get_full_word", "get_long", "get_name_ea")
+TYPES = ("segment_t", "fixup_data_t", "Choose2")
+# plan operations: WRITES as called, then the ones needing translation.
+OPS = WRITES + ("setup_selector", "add_segm_ex", "set_fixup", "mem2base", "file2base")
+(SEL, SEG, FIX, MEM, FILE) = range(len(WRITES), len(OPS))
+
+class Plan(object):
+	def __init__(self, ops, meta):
+		self.ops = ops # [(op, args...)]
+		self.meta = meta
+
+	def pack(self):
+		return MAGIC + zlib.compress(marshal.dumps((self.ops, self.meta), 2))
+
+	@classmethod
+	def unpack(cls, buf):
+		if buf[:len(MAGIC)] != MAGIC:
+			raise ValueError("not a plan")
+		(ops, meta) = marshal.loads(zlib.decompress(buf[len(MAGIC):]))
+		return cls(ops, meta)
+
+	# li[offset:] is what was recorded.
+	def replay(self, idaapi, li, offset):
+		sels = {} # recorded selector -> this database's
+		for op in self.ops:
+			code = op[0]
+			if code < SEL:
+				getattr(idaapi, OPS[code])(*op[1:])
+			elif code == SEL:
+				sels[op[2]] = idaapi.setup_selector(op[1])
+			elif code == SEG:
+				s = idaapi.segment_t()
+				(s.startEA, s.endEA, sel, s.bitness, s.align, s.comb, name, sclass, flags) = op[1:]
+				s.sel = sels.get(sel, sel)
+				idaapi.add_segm_ex(s, name, sclass, flags)
+			elif code == FIX:
+				fd = idaapi.fixup_data_t()
+				(ea, fd.type, sel, fd.off) = op[1:]
+				fd.sel = sels.get(sel, sel)
+				idaapi.set_fixup(ea, fd)
+			elif code == MEM:
+				(ea, fpos, size, patches) = op[1:]
+				image = bytearray(size)
+				if fpos >= 0:
+					fpos += offset
+					li.seek(fpos)
+					raw = li.read(size) or b''
+					image[0:len(raw)] = raw
+				for (off, data) in patches:
+					image[off:off + len(data)] = data
+				idaapi.mem2base(bytes(image), ea, fpos)
+			elif code == FILE:
+				(pos, ea1, ea2, patchable) = op[1:]
+				li.file2base(offset + pos, ea1, ea2, patchable)
+
+# Stands for idaapi (and li) of a loader while it loads, passing calls through and recording writes.
+# complete is False if the loader called something not known here, or read the file out of li[offset:offset+size];
+# such plan is not cached.
+class Recorder(object):
+	def __init__(self, real, li, offset, size):
+		self.real = real
+		self.rawli = li
+		self.li = RecordingInput(li, self)
+		self.offset = offset
+		self.size = size
+		self.ops = []
+		self.complete = True
+
+	# pos relative to offset, or None if [pos, pos+size) is out of what is loaded.
+	def relative(self, pos, size):
+		if self.offset <= pos and pos + size <= self.offset + self.size:
+			return pos - self.offset
+		return None
+
+	def __getattr__(self, name):
+		attr = getattr(self.real, name)
+		if name in WRITES:
+			code = OPS.index(name)
+			def write(*args):
+				self.ops.append((code,) + args)
+				return attr(*args)
+			return write
+		if name in READS or name in TYPES or not callable(attr):
+			return attr
+		if name in OPS:
+			return getattr(self, "_" + name)
+		self.complete = False
+		return attr
+
+	def _setup_selector(self, base):
+		sel = self.real.setup_selector(base)
+		self.ops.append((SEL, base, sel))
+		return sel
+
+	def _add_segm_ex(self, s, name, sclass, flags):
+		self.ops.append((SEG, s.startEA, s.endEA, s.sel, s.bitness, s.align, s.comb, name, sclass, flags))
+		return self.real.add_segm_ex(s, name, sclass, flags)
+
+	def _set_fixup(self, ea, fd):
+		self.ops.append((FIX, ea, fd.type, fd.sel, fd.off))
+		return self.real.set_fixup(ea, fd)
+
+	# image is kept as blocks differing from the file at fpos.
+	def _mem2base(self, data, ea, fpos):
+		data = bytes(data)
+		raw = b''
+		rel = self.relative(fpos, len(data)) if fpos >= 0 else None
+		if rel is not None:
+			pos = self.rawli.tell()
+			self.rawli.seek(fpos)
+			raw = self.rawli.read(len(data)) or b''
+			self.rawli.seek(pos)
+		else:
+			rel = -1
+		patches = []
+		for off in range(0, len(data), BLOCK):
+			block = data[off:off + BLOCK]
+			if block == raw[off:off + BLOCK] or (len(raw) <= off and not block.strip(b'\0')):
+				continue
+			if patches and patches[-1][0] + len(patches[-1][1]) == off:
+				patches[-1] = (patches[-1][0], patches[-1][1] + block)
+			else:
+				patches.append((off, block))
+		self.ops.append((MEM, ea, rel, len(data), patches))
+		return self.real.mem2base(data, ea, fpos)
+
+class RecordingInput(object):
+	def __init__(self, li, recorder):
+		self._li = li
+		self._recorder = recorder
+
+	def __getattr__(self, name):
+		return getattr(self._li, name)
+
+	def file2base(self, pos, ea1, ea2, patchable):
+		rel = self._recorder.relative(pos, ea2 - ea1)
+		if rel is None:
+			self._recorder.complete = False
+		else:
+			self._recorder.ops.append((FILE, rel, ea1, ea2, patchable))
+		return self._li.file2base(pos, ea1, ea2, patchable)
+
+# Plan files in a directory, keyed by content hash and loader version.
+class PlanCache(object):
+	_opened = {} # path -> PlanCache of this process
+
+	def __init__(self, path=None, maxsize=MAXSIZE):
+		self.path = path or defaultpath()
+		self.maxsize = maxsize
+		# counters as of saved, and with ones of this process since
+		self.saved = self.readstats()
+		(self.hits, self.misses, self.evictions) = self.saved
+
+	# one per path in a process; its counters are saved at exit.
+	@classmethod
+	def open(cls, path=None):
+		path = path or defaultpath()
+		cache = cls._opened.get(path)
+		if cache is None:
+			cache = cls._opened[path] = cls(path)
+			atexit.register(cache.savestats)
+		return cache
+
+	# key of li[offset:offset+size] loaded by loader (name, version and format it was accepted as).
+	# Python major version is in too; names in plans are native str.
+	@staticmethod
+	def key(loader, version, format, li, offset, size):
+		h = hashlib.sha1(("%s\0%d\0%s\0%d\0" % (loader, version, format, sys.version_info[0])).encode("latin-1"))
+		li.seek(offset)
+		while size > 0:
+			d = li.read(min(size, 0x100000))
+			if not d:
+				break
+			h.update(d)
+			size -= len(d)
+		li.seek(offset)
+		return h.hexdigest()
+
+	def planpath(self, key):
+		return os.path.join(self.path, key + ".plan")
+
+	def plans(self):
+		return glob.glob(os.path.join(self.path, "*.plan"))
+
+	# stats is records of counts added; summed here.
+	def readstats(self):
+		try:
+			with open(os.path.join(self.path, "stats"), "rb") as f:
+				buf = f.read()
+		except (IOError, OSError):
+			return (0, 0, 0)
+		records = [STATS.unpack_from(buf, off) for off in range(0, len(buf) - STATS.size + 1, STATS.size)]
+		return tuple([sum(counts) for counts in zip((0, 0, 0), *records)])
+
+	# appends counts since the last save; one small append, so other processes appending too lose nothing.
+	def savestats(self):
+		counts = (self.hits, self.misses, self.evictions)
+		if counts == self.saved:
+			return
+		try:
+			if not os.path.isdir(self.path):
+				os.makedirs(self.path)
+			with open(os.path.join(self.path, "stats"), "ab") as f:
+				f.write(STATS.pack(*[count - saved for (count, saved) in zip(counts, self.saved)]))
+		except (IOError, OSError):
+			return
+		self.saved = counts
+
+	# Plan, or None (counted as miss).
+	def get(self, key):
+		path = self.planpath(key)
+		plan = None
+		try:
+			with open(path, "rb") as f:
+				plan = Plan.unpack(f.read())
+			os.utime(path, None) # recently used
+		except (IOError, OSError, ValueError, EOFError, TypeError, zlib.error):
+			pass
+		if plan is None:
+			self.misses += 1
+		else:
+			self.hits += 1
+		return plan
+
+	def put(self, key, plan):
+		try:
+			if not os.path.isdir(self.path):
+				os.makedirs(self.path)
+			tmp = self.planpath(key) + ".tmp"
+			with open(tmp, "wb") as f:
+				f.write(plan.pack())
+			if os.path.exists(self.planpath(key)):
+				os.remove(self.planpath(key)) # rename does not replace on Windows
+			os.rename(tmp, self.planpath(key))
+		except (IOError, OSError):
+			return # read-only place? just not cache.
+		self.evict()
+
+	# remove least recently used plans until total size is within maxsize.
+	def evict(self):
+		plans = []
+		for path in self.plans():
+			try:
+				st = os.stat(path)
+			except OSError:
+				continue
+			plans.append((st.st_mtime, st.st_size, path))
+		total = sum([size for (_, size, _) in plans])
+		evicted = 0
+		for (_, size, path) in sorted(plans):
+			if total <= self.maxsize:
+				break
+			try:
+				os.remove(path)
+			except OSError:
+				continue
+			total -= size
+			evicted += 1
+		if evicted:
+			self.evictions += evicted
+			self.savestats()
+
+	def clear(self):
+		for path in self.plans():
+			os.remove(path)
+		try:
+			os.remove(os.path.join(self.path, "stats"))
+		except OSError:
+			pass
+		self.saved = (self.hits, self.misses, self.evictions) = (0, 0, 0)
+
+# Load li[offset:offset+size] by a loader module (name, version and format it was accepted as) through the cache
+# in default place: replays the plan of it, or runs load(li) (returns meta, None on failure) with idaapi of the
+# module recorded, and caches the plan. returns meta.
+def load(module, name, version, format, li, offset, size, run):
+	cache = PlanCache.open()
+	key = cache.key(name, version, format, li, offset, size)
+	plan = cache.get(key)
+	if plan is not None:
+		plan.replay(module.idaapi, li, offset)
+		return plan.meta
+	recorder = Recorder(module.idaapi, li, offset, size)
+	module.idaapi = recorder
+	try:
+		li.seek(offset)
+		meta = run(recorder.li)
+	finally:
+		module.idaapi = recorder.real
+	if meta is not None and recorder.complete:
+		cache.put(key, Plan(recorder.ops, meta))
+	return meta
+
+def main(args):
+	parser = argparse.ArgumentParser(description="load plan cache of os9rl.py/os9x.py")
+	parser.add_argument("-d", "--dir", help="cache directory (default: $OS9CACHE or ~/.os9cache)")
+	parser.add_argument("command", choices=["info", "clear"])
+	opts = parser.parse_args(args)
+
+	cache = PlanCache(opts.dir)
+	if opts.command == "clear":
+		cache.clear()
+		return 0
+	sizes = [os.path.getsize(path) for path in cache.plans()]
+	print("%s: %d plans, %d bytes (max %d)" % (cache.path, len(sizes), sum(sizes), cache.maxsize))
+	print("%d hits, %d misses, %d evicted" % (cache.hits, cache.misses, cache.evictions))
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
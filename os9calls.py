@@ -0,0 +1,223 @@
+# MIT License
+#
+# Copyright (c) 2021 Murachue
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# OS-9/68000 system call cross reference: syscall (trap #0 + function code word) -> call sites.
+# In IDA, os9_after.py records call sites in the database as it fixes syscall words:
+#   import os9calls
+#   os9calls.CallIndex.load().find("F$Fork")  # [ea...]
+#   os9calls.show()  # chooser of all call sites
+# From command line, call sites in modules/objects/libraries are exported (or searched) without IDA:
+# usage: python os9calls.py [-j JOBS] [-o OUT] [-c CALL]... PATH...
+
+from __future__ import print_function
+import os
+import sys
+import json
+import struct
+import argparse
+import multiprocessing
+try:
+	import idaapi
+	Choose2 = idaapi.Choose2
+except ImportError:
+	# command line
+	idaapi = None
+	Choose2 = object
+
+# function codes of trap #0 (funcs.a)
+NAMES = {
+	0x00: "F$Link", 0x01: "F$Load", 0x02: "F$UnLink", 0x03: "F$Fork",
+	0x04: "F$Wait", 0x05: "F$Chain", 0x06: "F$Exit", 0x07: "F$Mem",
+	0x08: "F$Send", 0x09: "F$Icpt", 0x0A: "F$Sleep", 0x0B: "F$SSpd",
+	0x0C: "F$ID", 0x0D: "F$SPrior", 0x0E: "F$STrap", 0x0F: "F$PErr",
+	0x10: "F$PrsNam", 0x11: "F$CmpNam", 0x12: "F$SchBit", 0x13: "F$AllBit",
+	0x14: "F$DelBit", 0x15: "F$Time", 0x16: "F$STime", 0x17: "F$CRC",
+	0x18: "F$GPrDsc", 0x19: "F$GBlkMp", 0x1A: "F$GModDr", 0x1B: "F$CpyMem",
+	0x1C: "F$SUser", 0x1D: "F$UnLoad", 0x1E: "F$RTE", 0x1F: "F$GPrDBT",
+	0x20: "F$Julian", 0x21: "F$TLink", 0x22: "F$DFork", 0x23: "F$DExec",
+	0x24: "F$DExit", 0x25: "F$DatMod", 0x26: "F$SetCRC", 0x27: "F$SetSys",
+	0x28: "F$SRqMem", 0x29: "F$SRtMem", 0x2A: "F$IRQ", 0x2B: "F$IOQu",
+	0x2C: "F$AProc", 0x2D: "F$NProc", 0x2E: "F$VModul", 0x2F: "F$FindPD",
+	0x30: "F$AllPD", 0x31: "F$RetPD", 0x32: "F$SSvc", 0x33: "F$IODel",
+	0x37: "F$GProcP", 0x38: "F$Move", 0x39: "F$AllRAM", 0x3A: "F$Permit",
+	0x3B: "F$Protect", 0x3F: "F$AllTsk", 0x40: "F$DelTsk", 0x4B: "F$AllPrc",
+	0x4C: "F$DelPrc", 0x4E: "F$FModul", 0x52: "F$SysDbg", 0x53: "F$Event",
+	0x54: "F$Gregor", 0x55: "F$SysID", 0x56: "F$Alarm", 0x57: "F$SigMask",
+	0x58: "F$ChkMem", 0x59: "F$UAcct", 0x5A: "F$CCtl", 0x5B: "F$GSPUMp",
+	0x5C: "F$SRqCMem", 0x5D: "F$POSK", 0x5E: "F$Panic", 0x5F: "F$MBuf",
+	0x60: "F$Trans",
+	0x80: "I$Attach", 0x81: "I$Detach", 0x82: "I$Dup", 0x83: "I$Create",
+	0x84: "I$Open", 0x85: "I$MakDir", 0x86: "I$ChgDir", 0x87: "I$Delete",
+	0x88: "I$Seek", 0x89: "I$Read", 0x8A: "I$Write", 0x8B: "I$ReadLn",
+	0x8C: "I$WritLn", 0x8D: "I$GetStt", 0x8E: "I$SetStt", 0x8F: "I$Close",
+	0x92: "I$SGetSt",
+}
+CODES = dict([(name.lower(), code) for (code, name) in NAMES.items()])
+
+# name of function code of trap #vector; others than trap #0 are user trap handlers.
+def callname(vector, code):
+	if vector != 0:
+		return "T%d$%04X" % (vector, code)
+	return NAMES.get(code) or ("I$%02X" % code if code & 0x80 else "F$%02X" % code)
+
+# (vector, code) of "F$Fork", "F$03", "T13$0010", "3" or "0x89"
+def parse(call):
+	code = CODES.get(call.lower())
+	if code is not None:
+		return (0, code)
+	upper = call.upper()
+	if upper[:2] in ["F$", "I$"]:
+		return (0, int(call[2:], 16))
+	if upper[:1] == "T" and "$" in call:
+		(vector, code) = call[1:].split("$", 1)
+		return (int(vector), int(code, 16))
+	return (0, int(call, 0))
+
+# call sites in the database, kept as a blob of (vector, code, ea) records.
+NODE = "$ os9calls"
+RECORD = struct.Struct('>HHI')
+
+class CallIndex(object):
+	def __init__(self, sites=None):
+		self.sites = sites or {} # (vector, code) -> set of ea
+
+	@classmethod
+	def load(cls):
+		blob = idaapi.netnode(NODE, 0, True).getblob(0, 'B') or b''
+		sites = {}
+		for i in range(len(blob) // RECORD.size):
+			(vector, code, ea) = RECORD.unpack_from(blob, RECORD.size * i)
+			sites.setdefault((vector, code), set()).add(ea)
+		return cls(sites)
+
+	def save(self):
+		records = [RECORD.pack(vector, code, ea) for ((vector, code), eas) in sorted(self.sites.items()) for ea in sorted(eas)]
+		idaapi.netnode(NODE, 0, True).setblob(b''.join(records), 0, 'B')
+
+	def add(self, ea, vector, code):
+		self.sites.setdefault((vector, code), set()).add(ea)
+
+	# drops sites that are not the syscall any more (undefined, patched...); returns how many.
+	def prune(self):
+		dropped = 0
+		for ((vector, code), eas) in list(self.sites.items()):
+			gone = set([ea for ea in eas if not (idaapi.isCode(idaapi.getFlags(ea)) and idaapi.get_item_head(ea) == ea and
+				idaapi.get_word(ea) == 0x4E40 | vector and idaapi.get_word(ea + 2) == code)])
+			eas -= gone
+			dropped += len(gone)
+			if not eas:
+				del self.sites[(vector, code)]
+		return dropped
+
+	def find(self, call):
+		return sorted(self.sites.get(parse(call), []))
+
+	# [(ea, vector, code)] sorted by ea
+	def all(self):
+		return sorted([(ea, vector, code) for ((vector, code), eas) in self.sites.items() for ea in eas])
+
+	# [(name, number of sites)]
+	def counts(self):
+		return [(callname(vector, code), len(self.sites[(vector, code)])) for (vector, code) in sorted(self.sites)]
+
+class CallChooser(Choose2):
+	def __init__(self, sites, title="OS-9 calls"):
+		cols = [
+			["Address",  8 | idaapi.Choose2.CHCOL_HEX],
+			["Call",    10 | idaapi.Choose2.CHCOL_PLAIN],
+			["Function", 24 | idaapi.Choose2.CHCOL_PLAIN],
+		]
+		idaapi.Choose2.__init__(self, title, cols)
+		self.sites = sites
+
+	def OnGetSize(self):
+		return len(self.sites)
+
+	def OnGetLine(self, n):
+		(ea, vector, code) = self.sites[n]
+		return [hex(ea), callname(vector, code), idaapi.get_func_name(ea) or ""]
+
+	def OnSelectLine(self, n):
+		idaapi.jumpto(self.sites[n][0])
+
+	def OnClose(self):
+		pass
+
+# chooser of call sites (of call if given) in the database.
+def show(call=None):
+	index = CallIndex.load()
+	sites = index.all()
+	if call is not None:
+		key = parse(call)
+		sites = [site for site in sites if site[1:] == key]
+	CallChooser(sites, "OS-9 calls" if call is None else "OS-9 calls: %s" % call).Show()
+
+# command line: call sites from os9plan.py's trap actions (its plan file is used if newer than the file).
+def units(path, pool=None):
+	import os9plan
+	planpath = path + os9plan.SUFFIX
+	if os.path.exists(planpath) and os.path.getmtime(planpath) >= os.path.getmtime(path):
+		return os9plan.read(planpath)
+	return os9plan.plan(path, os9plan.units(path), pool)
+
+def record(path, unit):
+	import os9plan
+	calls = {}
+	for (off, opcode, vector, kind, code) in unit.actions:
+		if kind == os9plan.TRAP:
+			calls.setdefault(callname(vector, code), []).append(off)
+	return {"path": path, "name": unit.name, "textpos": unit.textpos, "calls": calls}
+
+def main(args):
+	parser = argparse.ArgumentParser(description="export or search OS-9 system call sites in modules, objects and libraries")
+	parser.add_argument("paths", nargs="+")
+	parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes (default: cpu count)")
+	parser.add_argument("-o", "--output", help="output file (default: stdout)")
+	parser.add_argument("-c", "--call", action="append", help="only list modules calling this (F$Fork, I$89, T13$0010...)")
+	opts = parser.parse_args(args)
+
+	import os9export
+	wanted = set([callname(*parse(call)) for call in opts.call or []])
+	out = open(opts.output, "w") if opts.output else sys.stdout
+	pool = multiprocessing.Pool(opts.jobs) if opts.jobs != 1 else None
+	try:
+		for path in os9export.walk(opts.paths):
+			if os9export.fileformat(path) is None:
+				continue
+			for unit in units(path, pool):
+				rec = record(path, unit)
+				if not wanted:
+					out.write(json.dumps(rec, sort_keys=True) + "\n")
+					continue
+				for name in sorted(wanted & set(rec["calls"])):
+					out.write("%s(%s): %s %s\n" % (path, unit.name, name, " ".join(["%X" % off for off in rec["calls"][name]])))
+	finally:
+		if pool is not None:
+			pool.close()
+			pool.join()
+		if opts.output:
+			out.close()
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,334 @@
+# MIT License
+#
+# Copyright (c) 2021 Murachue
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Dump segment sizes, exports, imports and relocations of every relocatable object(.R)/library(.L)
+# member and OS-9 module in directory trees, one record per object.
+# usage: python os9export.py [-j JOBS] [-o OUT] [--msgpack] [--state STATE] PATH...
+
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import struct
+import hashlib
+import argparse
+import multiprocessing
+try:
+	import msgpack
+except ImportError:
+	msgpack = None
+
+import os9rl
+import os9x
+from os9headless import MmapInput
+
+# libraries larger than this are split into spans of about this size and processed in parallel.
+SPAN = 0x100000
+
+ROF_MAGIC = b'\xDE\xAD\xFA\xCE'
+MODULE_SYNC = b'\x4A\xFC'
+
+# group of relocations/import references of same kind
+def kindrecord(kind, addrs, reloc=True):
+	record = {
+		"write": kind.writesegment,
+		"width": kind.width,
+		"negative": kind.negative,
+		"relative": kind.relative,
+		"addrs": list(addrs),
+	}
+	if reloc:
+		record["to"] = kind.segment
+	return record
+
+# one ROF object (os9rl.Part)
+def rofrecord(path, part):
+	h = part.header
+	return {
+		"path": path,
+		"offset": part.offset,
+		"size": part.size,
+		"format": "rof",
+		"name": h.name,
+		"type": h.type,
+		"language": h.language,
+		"attribute": h.attribute,
+		"revision": h.revision,
+		"edition": h.edition,
+		"date": "%04d-%02d-%02d %02d:%02d:%02d" % tuple(h.date),
+		"textsize": h.textsize,
+		"idatasize": h.idatasize,
+		"bsssize": h.bsssize,
+		"stacksize": h.stacksize,
+		"remotebsssize": h.remotebsssize,
+		"remoteidatasize": h.remoteidatasize,
+		"debugsize": h.debugsize,
+		"entrypoint": h.entrypoint,
+		"trapinit": h.trapinit,
+		"exports": [[sym.name, sym.segment(), sym.addr] for sym in part.exports.entries],
+		"imports": [{"name": sym.name, "refs": [kindrecord(k, a, False) for (k, a) in sym.groups().items()]} for sym in part.imports.entries],
+		"relocs": [kindrecord(k, a) for (k, a) in part.relocs.groups().items()],
+	}
+
+# one module at offset (of a boot file)
+def modulerecord(path, li, offset=0):
+	li.seek(offset)
+	if os9x.readw(li) != 0x4AFC:
+		return None
+	h = os9x.Header(li)
+	(hexec, hexcpt, hmem, hstack, hidata, hirefs, hinit, hterm) = os9x.readexec(li, h.type)
+	name = None
+	if 0 < h.name < h.size:
+		d = bytes(li.view(offset + h.name, min(h.size - h.name, 256)))
+		if b'\0' in d:
+			name = d[:d.index(b'\0')].decode("latin-1")
+	record = {
+		"path": path,
+		"offset": offset,
+		"size": h.size,
+		"format": "module",
+		"name": name,
+		"type": h.type,
+		"language": h.lang,
+		"attribute": h.attr,
+		"revision": h.revs,
+		"edition": h.edit,
+		"crc": os9x.readcrc(li, offset, h.size).crc == os9x.CRC_GOOD,
+		"exec": hexec,
+		"excpt": hexcpt,
+		"mem": hmem,
+		"stack": hstack,
+	}
+	if hidata is not None:
+		li.seek(offset + hidata)
+		record["idata"] = [os9x.readl(li), os9x.readl(li)] # offset, size
+	if hirefs is not None:
+		blocks = os9x.readirefs(li, offset + hirefs, offset + h.size)
+		for (key, block) in zip(["irefs_text", "irefs_data"], blocks):
+			record[key] = [(msword << 16) | lsword for (_, msword, lswords) in block if lswords for lsword in lswords]
+	return record
+
+# records of a work unit: (path, format, start, end); objects starting in [start, end).
+def work(unit):
+	(path, format, start, end) = unit
+	li = MmapInput(path)
+	try:
+		records = []
+		if format == "module":
+			# every module of a boot file; first one even if its header is broken
+			for offset in os9x.walkchain(li) or [0]:
+				records.append(modulerecord(path, li, offset))
+		else:
+			li.seek(start)
+			r = os9rl.Reader(li)
+			# start of the object being read
+			offset = start
+			try:
+				for part in os9rl.walk(r, True, end):
+					records.append(partrecord(path, part))
+					offset = part.offset + part.size
+			except EOFError as e:
+				records.append(errorrecord(path, offset, e))
+				return records
+			if r.tell() < end:
+				records.append(errorrecord(path, r.tell(), "no ROF magic"))
+		return [record for record in records if record is not None]
+	except (EOFError, struct.error, KeyError, ValueError) as e:
+		return [errorrecord(path, start, e)]
+	finally:
+		li.close()
+
+# record of an object, or an error record when its flags are malformed (unknown segment, zero width).
+def partrecord(path, part):
+	try:
+		return rofrecord(path, part)
+	except (KeyError, ValueError) as e:
+		return errorrecord(path, part.offset, e)
+
+def errorrecord(path, offset, error):
+	if isinstance(error, Exception):
+		error = type(error).__name__ + (": %s" % error if str(error) else "")
+	return {"path": path, "offset": offset, "error": error}
+
+def workpath(unit):
+	return (unit[0], work(unit))
+
+def sha1(path):
+	h = hashlib.sha1()
+	with open(path, "rb") as f:
+		while True:
+			d = f.read(0x100000)
+			if not d:
+				break
+			h.update(d)
+	return h.hexdigest()
+
+def walk(paths):
+	for path in paths:
+		if os.path.isdir(path):
+			for (root, dirs, files) in os.walk(path):
+				dirs.sort()
+				for name in sorted(files):
+					yield os.path.join(root, name)
+		else:
+			yield path
+
+def fileformat(path):
+	with open(path, "rb") as f:
+		head = f.read(4)
+	if head == ROF_MAGIC:
+		return "rof"
+	if head[0:2] == MODULE_SYNC:
+		return "module"
+	return None
+
+# split large library at member boundaries.
+def units(path, format, size):
+	if format != "rof" or size <= SPAN:
+		return [(path, format, 0, size)]
+	li = MmapInput(path)
+	try:
+		result = []
+		start = 0
+		try:
+			for part in os9rl.walk(os9rl.Reader(li), False):
+				if part.offset + part.size - start >= SPAN:
+					result.append((path, format, start, part.offset + part.size))
+					start = part.offset + part.size
+		except EOFError:
+			pass
+		if start < size:
+			result.append((path, format, start, size))
+		return result
+	finally:
+		li.close()
+
+# state: {path: [size, mtime, sha1]} of the last run, to skip unchanged files.
+def loadstate(path):
+	try:
+		with open(path) as f:
+			return json.load(f)
+	except (IOError, OSError, ValueError):
+		return {}
+
+def savestate(path, state):
+	tmp = path + ".tmp"
+	with open(tmp, "w") as f:
+		json.dump(state, f)
+	if os.name == "nt" and os.path.exists(path):
+		os.remove(path)
+	os.rename(tmp, path)
+
+# (units to do, number of skipped files, {path: new state}). state of files to do is not updated here
+# but when all of their units are done without error.
+def plan(paths, state):
+	todo = []
+	skipped = 0
+	fresh = {}
+	for path in walk(paths):
+		format = fileformat(path)
+		if format is None:
+			continue
+		st = os.stat(path)
+		old = state.get(path)
+		if old and old[0] == st.st_size and old[1] == st.st_mtime:
+			skipped += 1
+			continue
+		digest = sha1(path)
+		if old and old[0] == st.st_size and old[2] == digest:
+			state[path] = [st.st_size, st.st_mtime, digest]
+			skipped += 1
+			continue
+		fresh[path] = [st.st_size, st.st_mtime, digest]
+		todo.extend(units(path, format, st.st_size))
+	return (todo, skipped, fresh)
+
+class Writer(object):
+	def __init__(self, f, packed):
+		self.f = f
+		self.packed = packed
+
+	def write(self, record):
+		if self.packed:
+			self.f.write(msgpack.packb(record))
+		else:
+			self.f.write((json.dumps(record, sort_keys=True) + "\n").encode("utf-8"))
+
+def main(args):
+	parser = argparse.ArgumentParser(description="dump OS-9/68000 objects, libraries and modules in trees")
+	parser.add_argument("paths", nargs="+")
+	parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes (default: cpu count)")
+	parser.add_argument("-o", "--output", help="output file (default: stdout)")
+	parser.add_argument("--msgpack", action="store_true", help="write msgpack stream instead of JSON lines")
+	parser.add_argument("--state", help="state file to skip files unchanged since the last run")
+	opts = parser.parse_args(args)
+
+	if opts.msgpack and msgpack is None:
+		parser.error("--msgpack requires msgpack module")
+
+	start = time.time()
+	state = loadstate(opts.state) if opts.state else {}
+	(todo, skipped, fresh) = plan(opts.paths, state)
+	# units not done yet of each path; a path with error is dropped.
+	pending = {}
+	for (path, _, _, _) in todo:
+		pending[path] = pending.get(path, 0) + 1
+
+	out = open(opts.output, "wb") if opts.output else getattr(sys.stdout, "buffer", sys.stdout)
+	writer = Writer(out, opts.msgpack)
+	objects = 0
+	errors = 0
+	nbytes = sum([end - begin for (_, _, begin, end) in todo])
+	pool = multiprocessing.Pool(opts.jobs)
+	try:
+		for (path, records) in pool.imap_unordered(workpath, todo):
+			for record in records:
+				if "error" in record:
+					errors += 1
+					pending.pop(path, None)
+					print("%s@%X: %s" % (record["path"], record["offset"], record["error"]), file=sys.stderr)
+				else:
+					objects += 1
+				writer.write(record)
+			out.flush()
+			if path in pending:
+				pending[path] -= 1
+				if pending[path] == 0:
+					del pending[path]
+					state[path] = fresh[path]
+	finally:
+		pool.close()
+		pool.join()
+		if opts.output:
+			out.close()
+
+	if opts.state:
+		savestate(opts.state, state)
+
+	elapsed = time.time() - start
+	print("%d units, %d files skipped, %d objects (%d errors), %d bytes in %.3fs (%.2f MB/s, %.0f objects/s)" % (
+		len(todo), skipped, objects, errors, nbytes, elapsed, nbytes / 1e6 / max(elapsed, 1e-9), objects / max(elapsed, 1e-9)), file=sys.stderr)
+	return 1 if errors else 0
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,373 @@
+# MIT License
+#
+# Copyright (c) 2021 Murachue
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Stand-in for IDA to run os9rl.py / os9x.py loaders under plain Python (batch, test, profile).
+# usage: python os9headless.py [-c CHOICE] [-f FORMAT] [--profile] FILE...
+#
+#   import os9headless
+#   db = os9headless.run("CDISYS.L", choice=3)
+#   db.names, db.fixups, db.segments, db.calls ...
+
+from __future__ import print_function
+import os
+import sys
+import mmap
+import time
+import types
+import argparse
+from collections import Counter
+
+# LoaderInput (li) backed by mmap.
+class MmapInput(object):
+	def __init__(self, path):
+		self.path = path
+		self.f = open(path, "rb")
+		if os.path.getsize(path) != 0:
+			self.map = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+		else:
+			self.map = b''
+		self.pos = 0
+
+	def close(self):
+		if not isinstance(self.map, bytes):
+			self.map.close()
+		self.f.close()
+
+	def size(self):
+		return len(self.map)
+
+	def tell(self):
+		return self.pos
+
+	def seek(self, offset, whence=0):
+		if whence == 1:
+			offset += self.pos
+		elif whence == 2:
+			offset += len(self.map)
+		self.pos = offset
+		return self.pos
+
+	# same as IDA: partial on short-read, None on EOF.
+	def read(self, bytes):
+		if self.pos >= len(self.map):
+			return None
+		d = self.map[self.pos:self.pos + bytes]
+		self.pos += len(d)
+		return d
+
+	# zero-copy slice of file (copy on Python 2, its mmap has no buffer interface)
+	def view(self, offset, bytes):
+		try:
+			return memoryview(self.map)[offset:offset + bytes]
+		except TypeError:
+			return self.map[offset:offset + bytes]
+
+	def file2base(self, pos, ea1, ea2, patchable):
+		Database.current.mem2base(self.view(pos, ea2 - ea1), ea1, pos)
+		return 1
+
+class Segment(object):
+	def __init__(self):
+		self.startEA = 0
+		self.endEA = 0
+		self.sel = 0
+		self.bitness = 0
+		self.align = 0
+		self.comb = 0
+
+class FixupData(object):
+	def __init__(self):
+		self.type = 0
+		self.sel = 0
+		self.off = 0
+
+# Recording back end for what the loaders ask to idaapi.
+# not loaded bytes read as 0xFF like IDA.
+class Database(object):
+	current = None
+
+	def __init__(self, path=None, choice=0):
+		self.path = path
+		self.choice = choice # what chooser returns; index or callable(chooser)
+		self.processor = None
+		self.mem = bytearray()
+		self.fileoffsets = [] # (ea, size, file offset)
+		self.segments = [] # (startEA, endEA, sel, name, sclass)
+		self.names = {} # ea -> name
+		self.eas = {} # name -> ea
+		self.items = {} # ea -> (kind, size)
+		self.fixups = {} # ea -> (type, sel, off)
+		self.comments = {} # (ea, repeatable) -> comment
+		self.entries = [] # (ord, ea, name)
+		self.pgmcmts = []
+		self.operands = {} # (ea, n) -> ("dec",) or ("offset", reftype, target, base, delta)
+		self.funcs = set()
+		self.calls = Counter()
+		self.blobs = {} # (netnode name, start, tag) -> blob
+
+	def _grow(self, end):
+		if end > len(self.mem):
+			self.mem.extend(b'\xFF' * (end - len(self.mem)))
+
+	def _get(self, ea, n):
+		self._grow(ea + n)
+		v = 0
+		for b in self.mem[ea:ea + n]:
+			v = (v << 8) | b
+		return v
+
+	def _put(self, ea, n, value):
+		self._grow(ea + n)
+		for i in range(n):
+			self.mem[ea + n - 1 - i] = (value >> (8 * i)) & 0xFF
+
+	def set_processor_type(self, name, level):
+		self.processor = name
+		return True
+
+	def get_input_file_path(self):
+		return self.path
+
+	def setup_selector(self, base):
+		return base
+
+	def add_segm_ex(self, s, name, sclass, flags):
+		self.segments.append((s.startEA, s.endEA, s.sel, name, sclass))
+		return True
+
+	def mem2base(self, mem, ea, fpos):
+		self._grow(ea + len(mem))
+		self.mem[ea:ea + len(mem)] = mem
+		self.fileoffsets.append((ea, len(mem), fpos))
+		return 1
+
+	def get_byte(self, ea):
+		return self._get(ea, 1)
+	def get_word(self, ea):
+		return self._get(ea, 2)
+	def get_full_word(self, ea):
+		return self._get(ea, 2)
+	def get_long(self, ea):
+		return self._get(ea, 4)
+	def put_byte(self, ea, value):
+		self._put(ea, 1, value)
+	def put_word(self, ea, value):
+		self._put(ea, 2, value)
+	def put_long(self, ea, value):
+		self._put(ea, 4, value)
+
+	def doByte(self, ea, length):
+		self.items[ea] = ("byte", length)
+		return True
+	def doWord(self, ea, length):
+		self.items[ea] = ("word", length)
+		return True
+	def doDwrd(self, ea, length):
+		self.items[ea] = ("dword", length)
+		return True
+
+	def set_name(self, ea, name, flags):
+		old = self.names.pop(ea, None)
+		if old is not None:
+			self.eas.pop(old, None)
+		if name:
+			self.names[ea] = name
+			self.eas[name] = ea
+		return True
+
+	def get_name_ea(self, base, name):
+		return self.eas.get(name, BADADDR)
+
+	def set_fixup(self, ea, fd):
+		self.fixups[ea] = (fd.type, fd.sel, fd.off)
+
+	def set_cmt(self, ea, comment, repeatable):
+		self.comments[(ea, repeatable)] = comment
+		return True
+
+	def add_pgm_cmt(self, comment):
+		self.pgmcmts.append(comment)
+
+	# as if OK is pressed
+	def askstr(self, hist, default, prompt):
+		return default
+
+	def add_entry(self, ord, ea, name, makecode):
+		self.entries.append((ord, ea, name))
+		return True
+
+	def add_func(self, start, end):
+		self.funcs.add(start)
+		return True
+
+	def op_dec(self, ea, n):
+		self.operands[(ea, n)] = ("dec",)
+		return True
+
+	def op_offset(self, ea, n, reftype, target, base, delta):
+		self.operands[(ea, n)] = ("offset", reftype, target, base, delta)
+		return True
+
+# netnode (blobs only) of Database.current.
+class Netnode(object):
+	def __init__(self, name, namelen=0, create=False):
+		self.name = name
+
+	def getblob(self, start, tag):
+		return Database.current.blobs.get((self.name, start, tag))
+
+	def setblob(self, buf, start, tag):
+		Database.current.blobs[(self.name, start, tag)] = bytes(buf)
+		return True
+
+	def delblob(self, start, tag):
+		return Database.current.blobs.pop((self.name, start, tag), None) is not None
+
+BADADDR = 0xFFFFffff
+
+# constants used by the loaders; taken from IDA SDK.
+CONSTANTS = {
+	"BADADDR": BADADDR,
+	"SEEK_SET": 0,
+	"SEEK_CUR": 1,
+	"SEEK_END": 2,
+	"ADDSEG_NOSREG": 0x0001,
+	"saRelByte": 1,
+	"scPub": 2,
+	"SN_CHECK": 0x01,
+	"SN_PUBLIC": 0x02,
+	"FIXUP_OFF8": 13,
+	"FIXUP_OFF16": 1,
+	"FIXUP_OFF32": 4,
+	"REF_OFF16": 1,
+	"REF_OFF32": 2,
+	"REFINFO_NOBASE": 0x80,
+	"HIST_SRCH": 3,
+}
+# idc.Name
+def Name(ea):
+	return Database.current.names.get(ea, "")
+
+# what IDA puts in loader's namespace (from idc)
+GLOBALS = {
+	"BADADDR": BADADDR,
+	"SETPROC_ALL": 0x01,
+	"SETPROC_FATAL": 0x80,
+	"Name": Name,
+}
+
+class Choose2(object):
+	CHCOL_PLAIN = 0x00000000
+	CHCOL_HEX = 0x00020000
+	CHCOL_DEC = 0x00030000
+
+	def __init__(self, title, cols, *args, **kwargs):
+		self.title = title
+		self.cols = cols
+
+	def Show(self, modal=False):
+		choice = Database.current.choice
+		return choice(self) if callable(choice) else choice
+
+def _dispatch(name):
+	def call(*args):
+		db = Database.current
+		db.calls[name] += 1
+		return getattr(db, name)(*args)
+	return call
+
+# idaapi module whose functions go to Database.current.
+def idaapi_module():
+	m = types.ModuleType("idaapi")
+	for name in dir(Database):
+		if not name.startswith("_") and callable(getattr(Database, name)):
+			setattr(m, name, _dispatch(name))
+	for (name, value) in CONSTANTS.items():
+		setattr(m, name, value)
+	m.segment_t = Segment
+	m.fixup_data_t = FixupData
+	m.Choose2 = Choose2
+	m.netnode = Netnode
+	return m
+
+# import a loader (os9rl/os9x) against the stand-in idaapi.
+def loader(name):
+	if "idaapi" not in sys.modules:
+		sys.modules["idaapi"] = idaapi_module()
+	module = __import__(name)
+	for (k, v) in GLOBALS.items():
+		setattr(module, k, v)
+	return module
+
+LOADERS = ["os9rl", "os9x"]
+
+# accept and load path like IDA does. returns Database, or None if nobody accepts.
+# n is the format number given to accept_file (ex. 1 for os9rl's whole library).
+def run(path, choice=0, loaders=LOADERS, n=0):
+	db = Database(path, choice)
+	Database.current = db
+	li = MmapInput(path)
+	try:
+		for name in loaders:
+			module = loader(name)
+			format = module.accept_file(li, n)
+			if format:
+				db.format = format
+				if not module.load_file(li, 0, format):
+					return None
+				return db
+		return None
+	finally:
+		Database.current = None
+		li.close()
+
+def main(args):
+	parser = argparse.ArgumentParser(description="load OS-9/68000 files with os9rl.py/os9x.py without IDA")
+	parser.add_argument("files", nargs="+")
+	parser.add_argument("-c", "--choice", type=int, default=0, help="library member index to load")
+	parser.add_argument("-f", "--format", type=int, default=0, help="format number to accept (1 for all library members)")
+	parser.add_argument("--profile", action="store_true", help="run under cProfile")
+	opts = parser.parse_args(args)
+
+	if opts.profile:
+		import cProfile
+		import pstats
+		profiler = cProfile.Profile()
+		profiler.enable()
+
+	for path in opts.files:
+		start = time.time()
+		db = run(path, opts.choice, n=opts.format)
+		elapsed = time.time() - start
+		if db is None:
+			print("%s: not accepted" % path)
+			continue
+		print("%s: %s, %d segments, %d names, %d fixups, %d items in %.3fs" % (
+			path, db.format, len(db.segments), len(db.names), len(db.fixups), len(db.items), elapsed))
+
+	if opts.profile:
+		profiler.disable()
+		pstats.Stats(profiler, stream=sys.stderr).sort_stats("cumulative").print_stats(30)
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
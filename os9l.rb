@@ -1,4 +1,6 @@
-# This is a generated file! Please edit source .ksy file and use kaitai-struct-compiler to rebuild
+# Ruby parser for os9l.ksy, on the Kaitai Struct runtime (kaitai-struct gem).
+# First compiled by kaitai-struct-compiler, then edited by hand for lazy payloads;
+# keep it in sync with os9l.ksy when changing either.
 
 require 'kaitai/struct/struct'
 
@@ -6,6 +8,12 @@ unless Gem::Version.new(Kaitai::Struct::VERSION) >= Gem::Version.new('0.9')
   raise "Incompatible Kaitai Struct Ruby API: 0.9 or later is required, but you have #{Kaitai::Struct::VERSION}"
 end
 
+
+##
+# Objects are chained by `next_obj` (not a sequence) so that text, idata and
+# other payloads can be lazy: they are positioned instances, read only when
+# accessed. Walking symbol tables of a whole library reads only metadata.
+# @see http://www.icdia.co.uk/microware/77165106.pdf Source
 class Os9l < Kaitai::Struct::Struct
   def initialize(_io, _parent = nil, _root = self)
     super(_io, _parent, _root)
@@ -13,29 +21,230 @@ class Os9l < Kaitai::Struct::Struct
   end
 
   def _read
-    @objects = []
-    i = 0
-    while not @_io.eof?
-      @objects << Obj.new(@_io, self, @_root)
-      i += 1
+    if !(_io.eof?)
+      @first = Obj.new(@_io, self, @_root)
     end
     self
   end
-  class Sym2a < Kaitai::Struct::Struct
+  class Obj < Kaitai::Struct::Struct
     def initialize(_io, _parent = nil, _root = self)
       super(_io, _parent, _root)
       _read
     end
 
     def _read
-      @flags = @_io.read_u2be
-      @addr = @_io.read_u4be
+      @magic = @_io.read_u4be
+      @type = @_io.read_u1
+      @language = @_io.read_u1
+      @attribute = @_io.read_u1
+      @revision = @_io.read_u1
+      @asmvalid = @_io.read_u2be
+      @asversion = @_io.read_u2be
+      @date = Date6.new(@_io, self, @_root)
+      @edition = @_io.read_u2be
+      @bsssize = @_io.read_u4be
+      @idatasize = @_io.read_u4be
+      @textsize = @_io.read_u4be
+      @stacksize = @_io.read_u4be
+      @entrypoint = @_io.read_u4be
+      @trapinit = @_io.read_u4be
+      @remotebsssize = @_io.read_u4be
+      @remoteidatasize = @_io.read_u4be
+      @debugsize = @_io.read_u4be
+      @name = (@_io.read_bytes_term(0, false, true, true)).force_encoding("ascii")
+      @nexportsyms = @_io.read_u2be
+      @exportsyms = Array.new(nexportsyms)
+      (nexportsyms).times { |i|
+        @exportsyms[i] = Exportsym.new(@_io, self, @_root)
+      }
+      @body = Position.new(@_io, self, @_root)
       self
     end
-    attr_reader :flags
-    attr_reader :addr
+    def importsyms
+      return @importsyms unless @importsyms.nil?
+      @importsyms = tables.importsyms
+      @importsyms
+    end
+    def ofs_idata
+      return @ofs_idata unless @ofs_idata.nil?
+      @ofs_idata = (ofs_text + textsize)
+      @ofs_idata
+    end
+    def reloc
+      return @reloc unless @reloc.nil?
+      @reloc = tables.reloc
+      @reloc
+    end
+    def remoteidata
+      return @remoteidata unless @remoteidata.nil?
+      _pos = @_io.pos
+      @_io.seek(ofs_remoteidata)
+      @remoteidata = @_io.read_bytes(remoteidatasize)
+      @_io.seek(_pos)
+      @remoteidata
+    end
+    def ofs_debug
+      return @ofs_debug unless @ofs_debug.nil?
+      @ofs_debug = (ofs_remoteidata + remoteidatasize)
+      @ofs_debug
+    end
+    def nimportsyms
+      return @nimportsyms unless @nimportsyms.nil?
+      @nimportsyms = tables.nimportsyms
+      @nimportsyms
+    end
+    def ofs_end
+      return @ofs_end unless @ofs_end.nil?
+      @ofs_end = tables.end.ofs
+      @ofs_end
+    end
+    def ofs_tables
+      return @ofs_tables unless @ofs_tables.nil?
+      @ofs_tables = (ofs_debug + debugsize)
+      @ofs_tables
+    end
+    def text
+      return @text unless @text.nil?
+      _pos = @_io.pos
+      @_io.seek(ofs_text)
+      @text = @_io.read_bytes(textsize)
+      @_io.seek(_pos)
+      @text
+    end
+    def debug
+      return @debug unless @debug.nil?
+      _pos = @_io.pos
+      @_io.seek(ofs_debug)
+      @debug = @_io.read_bytes(debugsize)
+      @_io.seek(_pos)
+      @debug
+    end
+    def ofs_remoteidata
+      return @ofs_remoteidata unless @ofs_remoteidata.nil?
+      @ofs_remoteidata = (ofs_idata + idatasize)
+      @ofs_remoteidata
+    end
+    def nreloc
+      return @nreloc unless @nreloc.nil?
+      @nreloc = tables.nreloc
+      @nreloc
+    end
+    def ofs_text
+      return @ofs_text unless @ofs_text.nil?
+      @ofs_text = body.ofs
+      @ofs_text
+    end
+    def next_obj
+      return @next_obj unless @next_obj.nil?
+      if ofs_end < _io.size
+        _pos = @_io.pos
+        @_io.seek(ofs_end)
+        @next_obj = Obj.new(@_io, self, @_root)
+        @_io.seek(_pos)
+      end
+      @next_obj
+    end
+    def idata
+      return @idata unless @idata.nil?
+      _pos = @_io.pos
+      @_io.seek(ofs_idata)
+      @idata = @_io.read_bytes(idatasize)
+      @_io.seek(_pos)
+      @idata
+    end
+    def tables
+      return @tables unless @tables.nil?
+      _pos = @_io.pos
+      @_io.seek(ofs_tables)
+      @tables = Reftables.new(@_io, self, @_root)
+      @_io.seek(_pos)
+      @tables
+    end
+    attr_reader :magic
+    attr_reader :type
+    attr_reader :language
+    attr_reader :attribute
+    attr_reader :revision
+    attr_reader :asmvalid
+    attr_reader :asversion
+    attr_reader :date
+    attr_reader :edition
+    attr_reader :bsssize
+    attr_reader :idatasize
+    attr_reader :textsize
+    attr_reader :stacksize
+    attr_reader :entrypoint
+
+    ##
+    # FFFFffff=undefined
+    attr_reader :trapinit
+    attr_reader :remotebsssize
+    attr_reader :remoteidatasize
+    attr_reader :debugsize
+    attr_reader :name
+    attr_reader :nexportsyms
+    attr_reader :exportsyms
+    attr_reader :body
+  end
+  class Reftables < Kaitai::Struct::Struct
+    def initialize(_io, _parent = nil, _root = self)
+      super(_io, _parent, _root)
+      _read
+    end
+
+    def _read
+      @nimportsyms = @_io.read_u2be
+      @importsyms = Array.new(nimportsyms)
+      (nimportsyms).times { |i|
+        @importsyms[i] = Importsym.new(@_io, self, @_root)
+      }
+      @nreloc = @_io.read_u2be
+      @reloc = Array.new(nreloc)
+      (nreloc).times { |i|
+        @reloc[i] = Reloc.new(@_io, self, @_root)
+      }
+      @unknown = @_io.read_bytes(16)
+      @end = Position.new(@_io, self, @_root)
+      self
+    end
+    attr_reader :nimportsyms
+    attr_reader :importsyms
+    attr_reader :nreloc
+    attr_reader :reloc
+    attr_reader :unknown
+    attr_reader :end
+  end
+
+  ##
+  # Zero sized, remembers the stream position where it is placed.
+  class Position < Kaitai::Struct::Struct
+    def initialize(_io, _parent = nil, _root = self)
+      super(_io, _parent, _root)
+      _read
+    end
+
+    def _read
+      if ofs >= 0
+        @mark = @_io.read_bytes(0)
+      end
+      self
+    end
+    def ofs
+      return @ofs unless @ofs.nil?
+      @ofs = _io.pos
+      @ofs
+    end
+    attr_reader :mark
   end
-  class Sym < Kaitai::Struct::Struct
+  class Exportsym < Kaitai::Struct::Struct
+
+    SEGMENT = {
+      0 => :segment_bss,
+      1 => :segment_data,
+      4 => :segment_text,
+      6 => :segment_const,
+    }
+    I__SEGMENT = SEGMENT.invert
     def initialize(_io, _parent = nil, _root = self)
       super(_io, _parent, _root)
       _read
@@ -47,11 +256,19 @@ class Os9l < Kaitai::Struct::Struct
       @addr = @_io.read_u4be
       self
     end
+    def segment
+      return @segment unless @segment.nil?
+      @segment = Kaitai::Struct::Stream::resolve_enum(SEGMENT, flags)
+      @segment
+    end
     attr_reader :name
+
+    ##
+    # 0x100=common 0=.bss 1=.data 4=.text 6=const
     attr_reader :flags
     attr_reader :addr
   end
-  class Sym2 < Kaitai::Struct::Struct
+  class Importsym < Kaitai::Struct::Struct
     def initialize(_io, _parent = nil, _root = self)
       super(_io, _parent, _root)
       _read
@@ -62,7 +279,7 @@ class Os9l < Kaitai::Struct::Struct
       @nentries = @_io.read_u2be
       @entries = Array.new(nentries)
       (nentries).times { |i|
-        @entries[i] = Sym2a.new(@_io, self, @_root)
+        @entries[i] = Importsymentry.new(@_io, self, @_root)
       }
       self
     end
@@ -70,90 +287,124 @@ class Os9l < Kaitai::Struct::Struct
     attr_reader :nentries
     attr_reader :entries
   end
-  class Obj < Kaitai::Struct::Struct
+  class Importsymentry < Kaitai::Struct::Struct
     def initialize(_io, _parent = nil, _root = self)
       super(_io, _parent, _root)
       _read
     end
 
     def _read
-      @magic = @_io.read_u4be
-      @x1 = @_io.read_u4be
-      @niner = @_io.read_u4be
-      @date = Date6.new(@_io, self, @_root)
-      @x4 = @_io.read_u2be
-      @x5 = @_io.read_u4be
-      @idatasize = @_io.read_u4be
-      @textsize = @_io.read_u4be
-      @x8 = @_io.read_u4be
-      @x9 = @_io.read_u4be
-      @xa = @_io.read_u4be
-      @xb = @_io.read_u4be
-      @xc = @_io.read_u4be
-      @xd = @_io.read_u4be
-      @name = (@_io.read_bytes_term(0, false, true, true)).force_encoding("ascii")
-      @nexportsyms = @_io.read_u2be
-      @exportsyms = Array.new(nexportsyms)
-      (nexportsyms).times { |i|
-        @exportsyms[i] = Sym.new(@_io, self, @_root)
-      }
-      @text = @_io.read_bytes(textsize)
-      @idata = @_io.read_bytes(idatasize)
-      @nimportsyms = @_io.read_u2be
-      @importsyms = Array.new(nimportsyms)
-      (nimportsyms).times { |i|
-        @importsyms[i] = Sym2.new(@_io, self, @_root)
-      }
-      @nreloc = @_io.read_u2be
-      @reloc = Array.new(nreloc)
-      (nreloc).times { |i|
-        @reloc[i] = Sym2a.new(@_io, self, @_root)
-      }
-      @nsyms3 = @_io.read_u2be
-      @syms3 = Array.new(nsyms3)
-      (nsyms3).times { |i|
-        @syms3[i] = Sym2.new(@_io, self, @_root)
-      }
-      @nz = @_io.read_u2be
-      @z = Array.new(nz)
-      (nz).times { |i|
-        @z[i] = Sym2a.new(@_io, self, @_root)
-      }
-      @zz1 = @_io.read_u4be
-      @zz2 = @_io.read_u4be
-      @zz3 = @_io.read_u4be
+      @flags = @_io.read_u2be
+      @addr = @_io.read_u4be
       self
     end
-    attr_reader :magic
-    attr_reader :x1
-    attr_reader :niner
-    attr_reader :date
-    attr_reader :x4
-    attr_reader :x5
-    attr_reader :idatasize
-    attr_reader :textsize
-    attr_reader :x8
-    attr_reader :x9
-    attr_reader :xa
-    attr_reader :xb
-    attr_reader :xc
-    attr_reader :xd
-    attr_reader :name
-    attr_reader :nexportsyms
-    attr_reader :exportsyms
-    attr_reader :text
-    attr_reader :idata
-    attr_reader :nimportsyms
-    attr_reader :importsyms
-    attr_reader :nreloc
-    attr_reader :reloc
-    attr_reader :nsyms3
-    attr_reader :syms3
-    attr_reader :nz
-    attr_reader :z
-    attr_reader :zz1
-    attr_reader :zz2
-    attr_reader :zz3
+    def widthstr
+      return @widthstr unless @widthstr.nil?
+      @widthstr = (width == 1 ? "b" : (width == 2 ? "w" : "l"))
+      @widthstr
+    end
+    def relative
+      return @relative unless @relative.nil?
+      @relative = (flags & 64) != 0
+      @relative
+    end
+    def relativestr
+      return @relativestr unless @relativestr.nil?
+      @relativestr = (relative ? "+" : "")
+      @relativestr
+    end
+    def negativestr
+      return @negativestr unless @negativestr.nil?
+      @negativestr = (negative ? "-" : "")
+      @negativestr
+    end
+    def width
+      return @width unless @width.nil?
+      @width = (1 << (((flags >> 3) & 3) - 1))
+      @width
+    end
+    def negative
+      return @negative unless @negative.nil?
+      @negative = (flags & 128) != 0
+      @negative
+    end
+    def segment
+      return @segment unless @segment.nil?
+      @segment = ((flags & 32) != 0 ? "text" : "data")
+      @segment
+    end
+
+    ##
+    # 0=data 0x20=code, 0x08=1b 0x10=2b 0x18=4b
+    attr_reader :flags
+    attr_reader :addr
+  end
+  class Reloc < Kaitai::Struct::Struct
+
+    SEGMENT = {
+      0 => :segment_bss,
+      1 => :segment_data,
+      4 => :segment_text,
+    }
+    I__SEGMENT = SEGMENT.invert
+    def initialize(_io, _parent = nil, _root = self)
+      super(_io, _parent, _root)
+      _read
+    end
+
+    def _read
+      @flags = @_io.read_u2be
+      @addr = @_io.read_u4be
+      self
+    end
+    def widthstr
+      return @widthstr unless @widthstr.nil?
+      @widthstr = (width == 1 ? "b" : (width == 2 ? "w" : "l"))
+      @widthstr
+    end
+    def relative
+      return @relative unless @relative.nil?
+      @relative = (flags & 64) != 0
+      @relative
+    end
+    def relativestr
+      return @relativestr unless @relativestr.nil?
+      @relativestr = (relative ? "+" : "")
+      @relativestr
+    end
+    def negativestr
+      return @negativestr unless @negativestr.nil?
+      @negativestr = (negative ? "-" : "")
+      @negativestr
+    end
+
+    ##
+    # where relocate r/w
+    def relsegment
+      return @relsegment unless @relsegment.nil?
+      @relsegment = ((flags & 32) != 0 ? "text" : "data")
+      @relsegment
+    end
+    def width
+      return @width unless @width.nil?
+      @width = (1 << (((flags >> 3) & 3) - 1))
+      @width
+    end
+
+    ##
+    # which relocation offset
+    def segmentto
+      return @segmentto unless @segmentto.nil?
+      @segmentto = Kaitai::Struct::Stream::resolve_enum(SEGMENT, (flags & 7))
+      @segmentto
+    end
+    def negative
+      return @negative unless @negative.nil?
+      @negative = (flags & 128) != 0
+      @negative
+    end
+    attr_reader :flags
+    attr_reader :addr
   end
   class Date6 < Kaitai::Struct::Struct
     def initialize(_io, _parent = nil, _root = self)
@@ -180,7 +431,10 @@ class Os9l < Kaitai::Struct::Struct
     attr_reader :day
     attr_reader :hour
     attr_reader :minute
+
+    ##
+    # ?
     attr_reader :second
   end
-  attr_reader :objects
+  attr_reader :first
 end
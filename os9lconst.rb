@@ -23,20 +23,72 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-require_relative "os9l"
-
-def main fn
-	objs = Os9l.from_file fn
-	objs.objects.each { |obj|
-		first = true
-		obj.exportsyms.each { |sym|
-			if sym.flags == 0x06
-				if first
-					first = false
-					puts "// #{obj.name}"
-				end
-				puts "#define #{sym.name.gsub('$', '_')} #{sym.addr}"
-			end
+# Streams the file: only header and symbol tables are read, payloads and
+# reference tables are seeked over, so one object's symbols at a time in memory.
+# Multiple libraries can be given; constants already printed are not repeated.
+
+MAGIC = 0xDEADFACE
+
+def read_exact io, len
+	d = io.read len
+	raise EOFError, "unexpected end of file" if d.nil? or d.bytesize < len
+	d
+end
+
+def read_asciz io
+	s = io.gets "\0"
+	raise EOFError, "unexpected end of file" if s.nil? or !s.end_with?("\0")
+	s.chomp("\0").force_encoding("ascii")
+end
+
+# yields (object name, [[symbol name, value], ...] of constants) per object
+def each_constants io
+	loop {
+		magic = io.read 4
+		break if magic.nil? or magic.empty?
+		raise "bad magic at #{io.pos - magic.bytesize}" if magic.unpack1("N") != MAGIC
+		# type..edition(20-4), bss idata text stack entry trapinit remotebss remoteidata debug
+		head = read_exact io, 16 + 9 * 4
+		_, idatasize, textsize, _, _, _, _, remoteidatasize, debugsize = head[16, 36].unpack("N9")
+		name = read_asciz io
+
+		consts = []
+		read_exact(io, 2).unpack1("n").times {
+			sym = read_asciz io
+			flags, addr = read_exact(io, 6).unpack("nN")
+			consts << [sym, addr] if flags == 0x06
+		}
+
+		io.seek textsize + idatasize + remoteidatasize + debugsize, IO::SEEK_CUR
+		read_exact(io, 2).unpack1("n").times {
+			read_asciz io
+			io.seek 6 * read_exact(io, 2).unpack1("n"), IO::SEEK_CUR
+		}
+		io.seek 6 * read_exact(io, 2).unpack1("n") + 16, IO::SEEK_CUR
+
+		yield name, consts
+	}
+end
+
+def main *fns
+	seen = {}
+	fns.each { |fn|
+		File.open(fn, "rb") { |io|
+			each_constants(io) { |name, consts|
+				first = true
+				consts.each { |sym, value|
+					if seen.key? sym
+						warn "#{fn}: #{name}: #{sym} = #{value} conflicts with #{seen[sym]}" if seen[sym] != value
+						next
+					end
+					seen[sym] = value
+					if first
+						first = false
+						puts "// #{name}"
+					end
+					puts "#define #{sym.gsub('$', '_')} #{value}"
+				}
+			}
 		}
 	}
 end
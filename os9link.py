@@ -0,0 +1,368 @@
+# MIT License
+#
+# Copyright (c) 2021 Murachue
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Static linker: links relocatable objects(.R) and needed library(.L) members into an OS-9/68000 program module.
+# usage: python os9link.py -o MODULE [-n NAME] [-l LIB.L]... OBJ.R...
+#
+# module: header, exec header, text of objects, name, M$IData (offset, size, initialized data), M$IRefs, CRC.
+# data area: bss of objects, common blocks, initialized data of objects; then stack.
+
+from __future__ import print_function
+import os
+import sys
+import time
+import struct
+import argparse
+
+import os9rl
+import os9x
+from os9headless import MmapInput
+
+class LinkError(Exception):
+	pass
+
+HEADER = struct.Struct('>HHIIIHBBBBHII14sH')
+EXEC = struct.Struct('>IIIIII') # exec, excpt, mem, stack, idata, irefs
+HEADERSIZE = HEADER.size + EXEC.size
+
+ACCS = 0x0555 # read and execute by everyone
+
+def align(n, a=2):
+	return (n + a - 1) & -a
+
+# an object to link, from a .R file or a library member.
+class Unit(object):
+	def __init__(self, path, offset, part, text, idata):
+		self.path = path
+		self.offset = offset
+		self.part = part
+		self.header = part.header
+		self.text = text
+		self.idata = idata
+		# where its sections are placed; text in module, others in data area.
+		self.textbase = None
+		self.bssbase = None
+		self.idatabase = None
+		self.bases = None
+
+	def __str__(self):
+		if self.offset is None:
+			return self.path
+		return "%s(%s)" % (self.path, self.header.name)
+
+	# li must be at magic.
+	@classmethod
+	def read(cls, li, path, offset, chunk=os9rl.Reader.CHUNK):
+		r = os9rl.Reader(li, chunk)
+		if r.readd() != 0xDEADFACE:
+			raise LinkError("%s: not a relocatable object" % path)
+		part = os9rl.Part(r)
+		if part.header.remotebsssize or part.header.remoteidatasize:
+			raise LinkError("%s: remote data is not supported" % path)
+		r.seek(part.textpos)
+		text = r.read(part.header.textsize)
+		r.seek(part.idatapos)
+		idata = r.read(part.header.idatasize)
+		return cls(path, offset, part, text, idata)
+
+	def place(self, textbase, bssbase, idatabase):
+		(self.textbase, self.bssbase, self.idatabase) = (textbase, bssbase, idatabase)
+		self.bases = {
+			"text": textbase,
+			"data": idatabase,
+			"bss": bssbase,
+			"const": 0,
+		}
+
+	def base(self, segment):
+		return self.bases[segment]
+
+# symbols exported by library members, by sidecar index of each library (see os9rl.LibraryIndex).
+class LibrarySet(object):
+	def __init__(self, paths):
+		self.paths = paths
+		self.lis = []
+		self.symbols = {} # name -> (library number, Member); first library, first member wins.
+		for (i, path) in enumerate(paths):
+			li = MmapInput(path)
+			self.lis.append(li)
+			for member in os9rl.LibraryIndex.open(li, path).members:
+				for name in member.exports:
+					if name not in self.symbols:
+						self.symbols[name] = (i, member)
+
+	def close(self):
+		for li in self.lis:
+			li.close()
+
+	def find(self, name):
+		return self.symbols.get(name)
+
+	def load(self, i, member):
+		li = self.lis[i]
+		li.seek(member.offset)
+		return Unit.read(li, self.paths[i], member.offset, member.size)
+
+# objects given, then library members needed to define what is undefined (dependency closure).
+def collect(objpaths, libs):
+	units = []
+	for path in objpaths:
+		li = MmapInput(path)
+		try:
+			units.append(Unit.read(li, path, None))
+		finally:
+			li.close()
+
+	defined = {} # name -> (Unit, ExportEntry)
+	pending = []
+	def add(unit):
+		for sym in unit.part.exports.entries:
+			if sym.name in defined:
+				if sym.flags & 0x100:
+					continue # common yields to definition (or other common; sized in layout)
+				if not defined[sym.name][1].flags & 0x100:
+					raise LinkError("%s: multiply defined in %s and %s" % (sym.name, defined[sym.name][0], unit))
+				# definition replaces common
+			defined[sym.name] = (unit, sym)
+		for sym in unit.part.imports.entries:
+			pending.append(sym.name)
+
+	for unit in units:
+		add(unit)
+
+	pulled = {} # (library number, member offset) -> Unit
+	undefined = set()
+	while pending:
+		name = pending.pop()
+		if name in defined or name in undefined:
+			continue
+		found = libs.find(name) if libs else None
+		if found is None:
+			undefined.add(name)
+			continue
+		(i, member) = found
+		unit = libs.load(i, member)
+		pulled[(i, member.offset)] = unit
+		add(unit)
+	if undefined:
+		raise LinkError("undefined: %s" % ", ".join(sorted(undefined)))
+
+	# library members in library order, to be reproducible.
+	units.extend([pulled[key] for key in sorted(pulled)])
+	return (units, defined)
+
+class Linker(object):
+	def __init__(self, units, defined, name=None):
+		self.units = units
+		self.defined = defined
+		self.root = None
+		for unit in units:
+			if unit.header.type != 0:
+				self.root = unit
+				break
+		if self.root is None:
+			raise LinkError("no program object (with entry point)")
+		if self.root.header.type != 1:
+			raise LinkError("%s: only program modules (type 1) are supported" % self.root)
+		self.name = name or self.root.header.name
+
+	def layout(self):
+		ea = HEADERSIZE
+		textbases = []
+		for unit in self.units:
+			textbases.append(ea)
+			ea = align(ea + unit.header.textsize)
+		self.textend = ea
+
+		off = 0
+		bssbases = []
+		for unit in self.units:
+			bssbases.append(off)
+			off = align(off + unit.header.bsssize)
+		# common blocks not defined elsewhere: largest size wins
+		self.commons = {}
+		for unit in self.units:
+			for sym in unit.part.exports.entries:
+				if sym.flags & 0x100 and self.defined[sym.name][1].flags & 0x100:
+					self.commons[sym.name] = max(self.commons.get(sym.name, 0), sym.addr)
+		self.commonbase = {}
+		for name in sorted(self.commons):
+			self.commonbase[name] = off
+			off = align(off + self.commons[name])
+		self.idatastart = off
+		for (unit, textbase, bssbase) in zip(self.units, textbases, bssbases):
+			unit.place(textbase, bssbase, off)
+			off = align(off + unit.header.idatasize)
+		self.dataend = off
+
+		self.stack = sum([unit.header.stacksize for unit in self.units])
+
+	# (segment, address in text or data area; value if const) of symbol
+	def resolve(self, name):
+		(unit, sym) = self.defined[name]
+		if sym.flags & 0x100:
+			return ("bss", self.commonbase[name])
+		segment = sym.segment()
+		return (segment, unit.base(segment) + sym.addr)
+
+	def link(self):
+		self.layout()
+		text = bytearray(self.textend - HEADERSIZE)
+		idata = bytearray(self.dataend - self.idatastart)
+		for unit in self.units:
+			text[unit.textbase - HEADERSIZE:unit.textbase - HEADERSIZE + len(unit.text)] = unit.text
+			idata[unit.idatabase - self.idatastart:unit.idatabase - self.idatastart + len(unit.idata)] = unit.idata
+		images = {
+			"text": (text, HEADERSIZE),
+			"data": (idata, self.idatastart),
+		}
+		irefs = {"text": set(), "data": set()}
+		# absolute long to text in text: module address -> [added - subtracted, symbol names]
+		textabs = {}
+
+		# references of one kind to target (in segment) at addrs of unit, to name (None if local).
+		# as os9rl.Relocator: pc-relative is replaced, others are added (or subtracted if negative).
+		def apply(unit, kind, addrs, segment, target, name=None):
+			limit = len(unit.text if kind.writesegment == "text" else unit.idata) - kind.width
+			(image, imagebase) = images[kind.writesegment]
+			base = unit.base(kind.writesegment) - imagebase
+			(st, mask) = os9rl.Relocator._formats[kind.width]
+			# pointer in data needs relocation at run time.
+			runtime = None
+			if kind.writesegment == "data" and kind.width == 4 and not kind.relative and not kind.negative and segment != "const":
+				runtime = irefs["text" if segment == "text" else "data"]
+			for addr in addrs:
+				if not 0 <= addr <= limit:
+					raise LinkError("%s: reference out of %s at %X" % (unit, kind.writesegment, addr))
+				if kind.writesegment == "text" and segment == "text" and kind.width == 4 and not kind.relative:
+					ref = textabs.setdefault(imagebase + base + addr, [0, []])
+					ref[0] += -1 if kind.negative else 1
+					ref[1].append(name or "%s text" % unit)
+				if kind.relative:
+					value = target - (imagebase + base + addr)
+					if kind.width == 2 and not (-0x8000 <= value < 0x8000):
+						raise LinkError("%s: %X is out of reach from %X" % (unit, target, imagebase + base + addr))
+				elif kind.negative:
+					value = st.unpack_from(image, base + addr)[0] - target
+				else:
+					value = st.unpack_from(image, base + addr)[0] + target
+					if runtime is not None:
+						runtime.add(imagebase + base + addr)
+				st.pack_into(image, base + addr, value & mask)
+
+		for unit in self.units:
+			for (kind, addrs) in unit.part.relocs.groups().items():
+				if kind.segment is None:
+					raise LinkError("%s: unknown relocation %04X" % (unit, kind.flags))
+				apply(unit, kind, addrs, kind.segment, unit.base(kind.segment))
+			for sym in unit.part.imports.entries:
+				(segment, target) = self.resolve(sym.name)
+				for (kind, addrs) in sym.groups().items():
+					apply(unit, kind, addrs, segment, target, sym.name)
+
+		# text is not relocated at run time (M$IRefs is of data only); differences of text addresses are fine.
+		for ea in sorted(textabs):
+			(count, names) = textabs[ea]
+			if count != 0:
+				raise LinkError("%s: absolute long reference to text at %X cannot be relocated" % (", ".join(names), ea))
+
+		self.text = text
+		self.idata = idata
+		self.irefs = irefs
+		return self.module()
+
+	@staticmethod
+	def irefsblock(offsets):
+		out = []
+		groups = {}
+		for off in sorted(offsets):
+			groups.setdefault(off >> 16, []).append(off & 0xFFFF)
+		for msword in sorted(groups):
+			lswords = groups[msword]
+			for i in range(0, len(lswords), 0xFFFF):
+				chunk = lswords[i:i + 0xFFFF]
+				out.append(struct.pack('>HH%dH' % len(chunk), msword, len(chunk), *chunk))
+		out.append(struct.pack('>HH', 0, 0))
+		return b''.join(out)
+
+	def module(self):
+		h = self.root.header
+		body = bytearray(self.text)
+		nameoff = HEADERSIZE + len(body)
+		body += os9rl.tobytes(self.name) + b'\0'
+		body += b'\0' * (align(len(body)) - len(body))
+		idataoff = HEADERSIZE + len(body)
+		body += struct.pack('>II', self.idatastart, len(self.idata)) + self.idata
+		body += b'\0' * (align(len(body)) - len(body))
+		irefsoff = HEADERSIZE + len(body)
+		body += self.irefsblock(self.irefs["text"]) + self.irefsblock(self.irefs["data"])
+		# size including CRC to be multiple of 4
+		body += b'\0' * (align(HEADERSIZE + len(body) + 3, 4) - 3 - HEADERSIZE - len(body))
+		size = HEADERSIZE + len(body) + 3
+
+		excpt = h.trapinit if h.trapinit != 0xFFFFffff else None
+		head = bytearray(HEADER.pack(0x4AFC, 1, size, 0, nameoff, ACCS, h.type, h.language, h.attribute, h.revision, h.edition, 0, 0, b'\0' * 14, 0))
+		head[-2:] = struct.pack('>H', os9x.parity(head))
+		module = bytearray(head) + EXEC.pack(
+			self.root.textbase + h.entrypoint,
+			self.root.textbase + excpt if excpt is not None else 0,
+			self.dataend + self.stack,
+			self.stack,
+			idataoff,
+			irefsoff,
+		) + body
+		module += struct.pack('>I', os9x.CRC24().update(module).stored())[1:]
+		return bytes(module)
+
+def main(args):
+	parser = argparse.ArgumentParser(description="link OS-9/68000 relocatable objects into a program module")
+	parser.add_argument("objects", nargs="+")
+	parser.add_argument("-o", "--output", required=True)
+	parser.add_argument("-n", "--name", help="module name (default: name of the program object)")
+	parser.add_argument("-l", "--library", action="append", default=[], help="library to resolve from (in order)")
+	parser.add_argument("-m", "--map", action="store_true", help="print where objects are placed")
+	opts = parser.parse_args(args)
+
+	start = time.time()
+	libs = LibrarySet(opts.library)
+	try:
+		(units, defined) = collect(opts.objects, libs)
+		linker = Linker(units, defined, opts.name)
+		module = linker.link()
+	except LinkError as e:
+		print("os9link: %s" % e, file=sys.stderr)
+		return 1
+	finally:
+		libs.close()
+	with open(opts.output, "wb") as f:
+		f.write(module)
+
+	if opts.map:
+		for unit in units:
+			print("%08X %08X %08X %s" % (unit.textbase, unit.bssbase, unit.idatabase, unit))
+	print("%d objects, text %X, data %X, module %X bytes in %.3fs" % (
+		len(units), linker.textend - HEADERSIZE, linker.dataend, len(module), time.time() - start), file=sys.stderr)
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,401 @@
+# MIT License
+#
+# Copyright (c) 2021 Murachue
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Pre-analyze text of OS-9/68000 modules and relocatable objects(.R)/libraries(.L) for os9_after.py,
+# without IDA: finds a6-relative operands, "move.l #x,Rn; jsr (pc,Rn.l)" pairs and trap + function code words,
+# and saves them as a plan (FILE.os9plan) that os9_after.py applies instead of decoding each instruction.
+# usage: python os9plan.py [-j JOBS] FILE...
+
+from __future__ import print_function
+import os
+import sys
+import time
+import struct
+import argparse
+import multiprocessing
+
+import os9rl
+import os9x
+from os9headless import MmapInput
+
+SUFFIX = ".os9plan"
+MAGIC = b'OS9PLAN1'
+
+# text larger than this is split into chunks and scanned in parallel.
+CHUNK = 0x40000
+# bytes an instruction found in a chunk may read past its end (move.l #imm,Rn + jsr (d8,pc,Xn))
+TAIL = 10
+
+# action kinds
+A6 = 1 # operand is (d16,a6) or (d8,a6,Xn); target is displacement
+PCREL = 2 # move.l #x,Rn of jsr (pc,Rn.l); target is offset x is relative to
+TRAP = 3 # trap #operand followed by function code word; target is the word
+KINDS = {A6: "a6", PCREL: "pcrel", TRAP: "trap"}
+
+# (offset in text, opcode word, operand, kind, target)
+ACTION = struct.Struct('>IHBBi')
+UNITHEAD = struct.Struct('>III')
+
+# 68000 instructions having an effective address field, for what os9_after.py needs:
+# (bits, size, extension words before ea's, ea class, operand number in IDA)
+# bits: 0/1 fixed, "e" ea (mode, reg), "s" size (00=b 01=w 10=l), "S" size (0=w 1=l), others free.
+# size: b/w/l, or "s"/"S" from bits, "-" for address only (no access of the size); "i" in extension words is an immediate of the size.
+# first matching (and valid) one wins.
+PATTERNS = [
+	("00000000sseeeeee", "s", "i", "da", 1), # ori
+	("00000010sseeeeee", "s", "i", "da", 1), # andi
+	("00000100sseeeeee", "s", "i", "da", 1), # subi
+	("00000110sseeeeee", "s", "i", "da", 1), # addi
+	("00001010sseeeeee", "s", "i", "da", 1), # eori
+	("00001100sseeeeee", "s", "i", "da", 1), # cmpi
+	("0000100000eeeeee", "b", "w", "dn", 1), # btst #
+	("00001000xxeeeeee", "b", "w", "da", 1), # bchg/bclr/bset #
+	("0000xxx100eeeeee", "b", "", "d", 1), # btst Dn
+	("0000xxx1xxeeeeee", "b", "", "da", 1), # bchg/bclr/bset Dn
+	("0100000011eeeeee", "w", "", "da", 1), # move sr
+	("01000000sseeeeee", "s", "", "da", 0), # negx
+	("0100xxx110eeeeee", "w", "", "d", 0), # chk
+	("0100xxx111eeeeee", "-", "", "c", 0), # lea
+	("01000010sseeeeee", "s", "", "da", 0), # clr
+	("0100010011eeeeee", "w", "", "d", 0), # move ccr
+	("01000100sseeeeee", "s", "", "da", 0), # neg
+	("0100011011eeeeee", "w", "", "d", 0), # move to sr
+	("01000110sseeeeee", "s", "", "da", 0), # not
+	("0100100000eeeeee", "b", "", "da", 0), # nbcd
+	("0100100001eeeeee", "-", "", "c", 0), # pea
+	("010010001xeeeeee", "-", "w", "ca-", 1), # movem to memory
+	("0100101011eeeeee", "b", "", "da", 0), # tas
+	("01001010sseeeeee", "s", "", "da", 0), # tst
+	("010011001xeeeeee", "-", "w", "c+", 0), # movem from memory
+	("0100111010eeeeee", "-", "", "c", 0), # jsr
+	("0100111011eeeeee", "-", "", "c", 0), # jmp
+	("0101xxxx11eeeeee", "b", "", "da", 0), # scc
+	("0101xxx0sseeeeee", "s", "", "a", 1), # addq
+	("0101xxx1sseeeeee", "s", "", "a", 1), # subq
+	("1000xxx011eeeeee", "w", "", "d", 0), # divu
+	("1000xxx111eeeeee", "w", "", "d", 0), # divs
+	("1000xxx0sseeeeee", "s", "", "d", 0), # or to Dn
+	("1000xxx1sseeeeee", "s", "", "ma", 1), # or Dn
+	("1001xxxS11eeeeee", "S", "", "*", 0), # suba
+	("1001xxx0sseeeeee", "s", "", "*", 0), # sub to Dn
+	("1001xxx1sseeeeee", "s", "", "ma", 1), # sub Dn
+	("1011xxxS11eeeeee", "S", "", "*", 0), # cmpa
+	("1011xxx0sseeeeee", "s", "", "*", 0), # cmp
+	("1011xxx1sseeeeee", "s", "", "da", 1), # eor
+	("1100xxx011eeeeee", "w", "", "d", 0), # mulu
+	("1100xxx111eeeeee", "w", "", "d", 0), # muls
+	("1100xxx0sseeeeee", "s", "", "d", 0), # and to Dn
+	("1100xxx1sseeeeee", "s", "", "ma", 1), # and Dn
+	("1101xxxS11eeeeee", "S", "", "*", 0), # adda
+	("1101xxx0sseeeeee", "s", "", "*", 0), # add to Dn
+	("1101xxx1sseeeeee", "s", "", "ma", 1), # add Dn
+	("11100xxx11eeeeee", "w", "", "ma", 0), # shift/rotate memory
+]
+
+SIZES = {"b": 1, "w": 2, "l": 4, "-": 0}
+
+# is (mode, reg) in ea class?
+def eaok(cls, mode, reg):
+	if mode == 7 and reg > 4:
+		return False
+	if cls == "*":
+		return True
+	if mode == 1:
+		return cls == "a"
+	if cls == "d":
+		return True
+	if cls == "dn":
+		return not (mode == 7 and reg == 4)
+	if mode == 0:
+		return cls in ["da", "a"]
+	if cls in ["da", "ma", "a"]:
+		return not (mode == 7 and reg >= 2)
+	# control
+	if mode == 3:
+		return cls == "c+"
+	if mode == 4:
+		return cls == "ca-"
+	return not (mode == 7 and (reg == 4 or (cls == "ca-" and reg >= 2)))
+
+# extension bytes of ea
+def extsize(mode, reg, size):
+	if mode in [5, 6]:
+		return 2
+	if mode == 7:
+		return [2, 4, 2, 2, 4 if size == 4 else 2][reg]
+	return 0
+
+def isa6(mode, reg):
+	return mode in [5, 6] and reg == 6
+
+# opcode -> ((operand, offset of extension, mode, access width or 0), ...) of a6 operands
+def _a6table():
+	table = {}
+	claimed = bytearray(0x10000)
+	for (bits, sizespec, extra, cls, operand) in PATTERNS:
+		value = int("".join([c if c in "01" else "0" for c in bits]), 2)
+		free = [15 - i for (i, c) in enumerate(bits) if c not in "01"]
+		for n in range(1 << len(free)):
+			op = value
+			for (i, bit) in enumerate(free):
+				if n & (1 << i):
+					op |= 1 << bit
+			if claimed[op]:
+				continue
+			if sizespec == "s":
+				s = (op >> 6) & 3
+				if s == 3:
+					continue
+				size = 1 << s
+			elif sizespec == "S":
+				size = 4 if op & 0x100 else 2
+			else:
+				size = SIZES[sizespec]
+			(mode, reg) = ((op >> 3) & 7, op & 7)
+			if not eaok(cls, mode, reg):
+				continue
+			claimed[op] = 1
+			if isa6(mode, reg):
+				ext = 2 + sum([max(size, 2) if w == "i" else 2 for w in extra])
+				table[op] = ((operand, ext, mode, size),)
+	# move/movea: source then destination
+	for op in range(0x1000, 0x4000):
+		size = {1: 1, 3: 2, 2: 4}[op >> 12]
+		(smode, sreg) = ((op >> 3) & 7, op & 7)
+		(dmode, dreg) = ((op >> 6) & 7, (op >> 9) & 7)
+		if not eaok("*", smode, sreg) or (size == 1 and smode == 1):
+			continue
+		if not eaok("a" if size != 1 else "da", dmode, dreg):
+			continue
+		rules = []
+		if isa6(smode, sreg):
+			rules.append((0, 2, smode, size))
+		if isa6(dmode, dreg):
+			rules.append((1, 2 + extsize(smode, sreg, size), dmode, size))
+		if rules:
+			table[op] = tuple(rules)
+	# movep (d16,a6); every other byte
+	for op in range(0x010E, 0x1000, 0x200):
+		for opmode in range(4):
+			table[op | (opmode << 6)] = ((1 if opmode & 2 else 0, 2, 5, 0),)
+	return table
+
+A6TABLE = _a6table()
+
+# opcode words that may start an action
+INTERESTING = bytearray(0x10000)
+for _op in A6TABLE:
+	INTERESTING[_op] = 1
+for _op in range(0x4E40, 0x4E50): # trap
+	INTERESTING[_op] = 1
+for _reg in range(8):
+	INTERESTING[0x203C | (_reg << 9)] = 1 # move.l #x,Dn
+	INTERESTING[0x207C | (_reg << 9)] = 1 # movea.l #x,An
+
+def s8(v):
+	return v - 0x100 if v & 0x80 else v
+
+def s16(v):
+	return v - 0x10000 if v & 0x8000 else v
+
+def s32(v):
+	return v - 0x100000000 if v & 0x80000000 else v
+
+# actions of instructions at even offsets in [start, end) of text (data must have TAIL more bytes past end, if any).
+# every offset is tried, not only ones a linear sweep reaches; os9_after.py applies ones at code heads.
+def scan(data, start, end):
+	n = (min(end, len(data)) - start) // 2
+	words = struct.unpack_from(">%dH" % n, data, start)
+	actions = []
+	for i in [i for (i, w) in enumerate(words) if INTERESTING[w]]:
+		op = words[i]
+		off = start + 2 * i
+		if 0x4E40 <= op < 0x4E50:
+			if off + 4 <= len(data):
+				actions.append((off, op, op & 15, TRAP, struct.unpack_from(">H", data, off + 2)[0]))
+			continue
+		rules = A6TABLE.get(op)
+		if rules is not None:
+			for (operand, ext, mode, _) in rules:
+				if off + ext + 2 > len(data):
+					continue
+				d = struct.unpack_from(">H", data, off + ext)[0]
+				actions.append((off, op, operand, A6, s16(d) if mode == 5 else s8(d & 0xFF)))
+			continue
+		# move.l #x,Rn; jsr (d8,pc,Rn.l)
+		if off + 10 <= len(data):
+			(jsr, index) = struct.unpack_from(">HH", data, off + 6)
+			reg = ((op >> 9) & 7) | (8 if op & 0x40 else 0)
+			if jsr == 0x4EBB and (index >> 12) == reg and index & 0x800:
+				actions.append((off, op, 0, PCREL, off + 8 + s8(index & 0xFF)))
+	return actions
+
+# pieces: [(textpos, text size, start, end)] of a file
+def _scanpieces(args):
+	(path, pieces) = args
+	result = []
+	with open(path, "rb") as f:
+		for (textpos, size, start, end) in pieces:
+			f.seek(textpos + start)
+			data = f.read(min(end + TAIL, size) - start)
+			# offsets are relative to data here
+			result.append([(off + start, op, operand, kind, target + (start if kind == PCREL else 0))
+				for (off, op, operand, kind, target) in scan(data, 0, end - start)])
+	return result
+
+# text of a module or an object to be planned
+class Unit(object):
+	def __init__(self, name, segment, textpos, size, actions=None):
+		self.name = name
+		self.segment = segment # IDA segment name given by the loader
+		self.textpos = textpos
+		self.size = size
+		self.actions = actions or []
+
+	def __repr__(self):
+		return "Unit(%r, %r, %#x, %#x, %d actions)" % (self.name, self.segment, self.textpos, self.size, len(self.actions))
+
+# units of a file: the whole module (os9x.py maps it to .text), or text of each object.
+def units(path):
+	li = MmapInput(path)
+	try:
+		li.seek(0)
+		head = li.read(4)
+		if head is None or len(head) < 4:
+			return []
+		if head[0:2] == b'\x4A\xFC':
+			# boot file loads each module as NAME:.text
+			offsets = os9x.walkchain(li)
+			if len(offsets) > 1:
+				modules = [os9x.Module(li, offset) for offset in offsets]
+				return [Unit(name, name + ":.text", m.offset, m.header.size) for (m, name) in zip(modules, os9x.modulenames(modules))]
+			li.seek(2)
+			h = os9x.Header(li)
+			name = os.path.basename(path)
+			if 0 < h.name < h.size:
+				d = bytes(li.view(h.name, min(h.size - h.name, 256)))
+				if b'\0' in d:
+					name = d[:d.index(b'\0')].decode("latin-1")
+			return [Unit(name, ".text", 0, min(h.size, li.size()))]
+		result = []
+		li.seek(0)
+		try:
+			for part in os9rl.walk(os9rl.Reader(li), False):
+				result.append(Unit(part.header.name, part.header.name + ":.text", part.textpos, part.header.textsize))
+		except EOFError:
+			pass
+		# single object file loads as .text
+		if len(result) == 1:
+			result[0].segment = ".text"
+		return result
+	finally:
+		li.close()
+
+# fills actions of units by scanning their text in chunks (in pool if given).
+# small units are put together in a job of about a chunk.
+def plan(path, units, pool=None):
+	jobs = [[]]
+	size = 0
+	for (i, unit) in enumerate(units):
+		for start in range(0, unit.size, CHUNK):
+			end = min(start + CHUNK, unit.size)
+			if size >= CHUNK:
+				jobs.append([])
+				size = 0
+			jobs[-1].append((i, (unit.textpos, unit.size, start, end)))
+			size += end - start
+	results = (pool.imap if pool is not None else map)(_scanpieces, [(path, [piece for (_, piece) in job]) for job in jobs])
+	for (job, actionss) in zip(jobs, results):
+		for ((i, _), actions) in zip(job, actionss):
+			units[i].actions.extend(actions)
+	return units
+
+def write(path, units):
+	tmp = path + ".tmp"
+	with open(tmp, "wb") as f:
+		f.write(MAGIC + struct.pack(">I", len(units)))
+		for unit in units:
+			for s in [unit.name, unit.segment]:
+				b = s.encode("latin-1")
+				f.write(struct.pack(">H", len(b)) + b)
+			f.write(UNITHEAD.pack(unit.textpos, unit.size, len(unit.actions)))
+			f.write(b''.join([ACTION.pack(*action) for action in unit.actions]))
+	if os.name == "nt" and os.path.exists(path):
+		os.remove(path)
+	os.rename(tmp, path)
+
+def read(path):
+	with open(path, "rb") as f:
+		data = f.read()
+	if data[0:8] != MAGIC:
+		raise ValueError("not a plan: %s" % path)
+	(count,) = struct.unpack_from(">I", data, 8)
+	pos = 12
+	result = []
+	for _ in range(count):
+		names = []
+		for _ in range(2):
+			(n,) = struct.unpack_from(">H", data, pos)
+			names.append(data[pos + 2:pos + 2 + n].decode("latin-1"))
+			pos += 2 + n
+		(textpos, size, nactions) = UNITHEAD.unpack_from(data, pos)
+		pos += UNITHEAD.size
+		actions = [ACTION.unpack_from(data, pos + ACTION.size * i) for i in range(nactions)]
+		pos += ACTION.size * nactions
+		result.append(Unit(names[0], names[1], textpos, size, actions))
+	return result
+
+def main(args):
+	parser = argparse.ArgumentParser(description="pre-analyze OS-9/68000 modules, objects and libraries for os9_after.py")
+	parser.add_argument("paths", nargs="+")
+	parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes (default: cpu count)")
+	opts = parser.parse_args(args)
+
+	start = time.time()
+	pool = multiprocessing.Pool(opts.jobs) if opts.jobs != 1 else None
+	nbytes = 0
+	try:
+		for path in opts.paths:
+			t = time.time()
+			us = plan(path, units(path), pool)
+			if not us:
+				print("%s: not a module or object" % path, file=sys.stderr)
+				continue
+			write(path + SUFFIX, us)
+			size = sum([u.size for u in us])
+			nbytes += size
+			counts = {}
+			for u in us:
+				for action in u.actions:
+					counts[action[3]] = counts.get(action[3], 0) + 1
+			print("%s: %d units, %d bytes, %s in %.3fs" % (path, len(us), size,
+				", ".join(["%d %s" % (counts.get(k, 0), KINDS[k]) for k in sorted(KINDS)]), time.time() - t))
+	finally:
+		if pool is not None:
+			pool.close()
+			pool.join()
+	elapsed = time.time() - start
+	print("%d files, %d bytes in %.3fs (%.2f MB/s)" % (len(opts.paths), nbytes, elapsed, nbytes / 1e6 / max(elapsed, 1e-9)), file=sys.stderr)
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
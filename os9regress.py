@@ -0,0 +1,307 @@
+# MIT License
+#
+# Copyright (c) 2021 Murachue
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Regression check of the loaders: builds small sample files (objects, libraries, program modules, a boot file),
+# loads them headless (os9headless.py) with the loaders here and with the ones of a git revision, and compares
+# the databases. Also checks that loading through the plan cache (os9cache.py) gives the same database as not,
+# also for a library member at other offset, and that debug sections are found past remote idata.
+# The loaders of the first commit (default REV) run only under Python 2 (xrange, reduce); run this with python2 then.
+# usage: python os9regress.py [-r REV] [-k DIR]
+
+from __future__ import print_function
+import os
+import sys
+import shutil
+import pickle
+import struct
+import argparse
+import tempfile
+import time
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+ROFHEADER = struct.Struct('>IBBBBHH6BH9I')
+
+# what is compared of os9headless.Database (call counts are not; loaders may do the same with less calls)
+FIELDS = ["processor", "format", "mem", "fileoffsets", "segments", "names", "items", "fixups", "comments",
+	"entries", "pgmcmts", "operands", "funcs", "blobs"]
+
+def asciz(s):
+	return s.encode("latin-1") + b'\0'
+
+# ROF object. exports: [(name, flags, addr)], imports: [(name, [(flags, addr)])], relocs: [(flags, addr)].
+# text is nops with zero where it is referenced.
+def rof(name, type, textsize, idata=b'', bsssize=0, exports=(), imports=(), relocs=(), remoteidata=b'', debug=b''):
+	text = bytearray(b'\x4E\x71' * (textsize // 2))
+	for (flags, addr) in list(relocs) + [ref for (_, refs) in imports for ref in refs]:
+		width = 1 << (((flags >> 3) & 3) - 1)
+		if flags & 0x20:
+			text[addr:addr + width] = b'\0' * width
+	out = [ROFHEADER.pack(0xDEADFACE, type, 1, 0x80, 1, 0, 0x100, 121, 10, 18, 12, 34, 56, 1,
+		bsssize, len(idata), textsize, 0x100, 0, 0xFFFFFFFF, 0, len(remoteidata), len(debug)) + asciz(name)]
+	out.append(struct.pack('>H', len(exports)))
+	for (sym, flags, addr) in exports:
+		out.append(asciz(sym) + struct.pack('>HI', flags, addr))
+	out += [bytes(text), idata, remoteidata, debug]
+	out.append(struct.pack('>H', len(imports)))
+	for (sym, refs) in imports:
+		out.append(asciz(sym) + struct.pack('>H', len(refs)) + b''.join([struct.pack('>HI', f, a) for (f, a) in refs]))
+	out.append(struct.pack('>H', len(relocs)) + b''.join([struct.pack('>HI', f, a) for (f, a) in relocs]))
+	out.append(b'\0' * 16)
+	return b''.join(out)
+
+# debug data of the object that has remote idata; unique in the samples, to find where it is.
+DEBUG = b'\0\x01dbg.c\0dbgfn\0' + b'\x55' * 0x30
+
+def samples(path):
+	import os9link
+	objects = {
+		"prog.r": rof("prog", 1, 0x20, b'\0' * 16, 8,
+			[("main", 4, 0), ("table", 1, 4), ("gcount", 0x100, 4)],
+			[("func", [(0x10 | 0x20 | 0x80, 6)]), ("gbuf", [(0x10 | 0x20, 10)])],
+			[(0x18 | 4, 0), (0x18 | 1, 4), (0x10 | 0x20 | 1, 14), (0x10 | 0x20, 18)]),
+		"func.r": rof("func", 0, 0x10, exports=[("func", 4, 0), ("func2", 4, 8), ("gcount", 0x100, 8)],
+			imports=[("gbuf", [(0x10 | 0x20, 2)])]),
+		"data.r": rof("data", 0, 4, b'\0' * 8, 0x40, [("gbuf", 0, 0), ("gtab", 1, 0)], relocs=[(0x18 | 4, 4)]),
+		"dbg.r": rof("dbg", 0, 0x10, b'\0' * 4, exports=[("dbgfn", 4, 0)], relocs=[(0x18 | 1, 0)],
+			remoteidata=b'\xAA' * 6, debug=DEBUG),
+	}
+	for (name, data) in objects.items():
+		with open(os.path.join(path, name), "wb") as f:
+			f.write(data)
+	with open(os.path.join(path, "lib.l"), "wb") as f:
+		f.write(objects["func.r"] + objects["data.r"] + objects["dbg.r"])
+	# without remote idata (loaders before it was supported can list it)
+	with open(os.path.join(path, "plain.l"), "wb") as f:
+		f.write(objects["func.r"] + objects["data.r"])
+	# same members at other offsets
+	with open(os.path.join(path, "lib2.l"), "wb") as f:
+		f.write(objects["prog.r"] + objects["func.r"] + objects["data.r"] + objects["dbg.r"])
+	modules = []
+	for name in ["prog", "tool"]:
+		libs = os9link.LibrarySet([os.path.join(path, "lib.l")])
+		try:
+			(units, defined) = os9link.collect([os.path.join(path, "prog.r")], libs)
+			modules.append(os9link.Linker(units, defined, name).link())
+		finally:
+			libs.close()
+	with open(os.path.join(path, "prog.mod"), "wb") as f:
+		f.write(modules[0])
+	with open(os.path.join(path, "boot.bin"), "wb") as f:
+		f.write(b''.join(modules))
+
+# (label, file, chooser index, format number, loader, new); new ones need what the first loaders did not support.
+CASES = [
+	("object", "prog.r", 0, 0, "os9rl", False),
+	("object with remote idata", "dbg.r", 0, 0, "os9rl", True),
+	("library member", "plain.l", 1, 0, "os9rl", False),
+	("library member with remote idata", "lib.l", 2, 0, "os9rl", True),
+	("library", "lib.l", 0, 1, "os9rl", True),
+	("module", "prog.mod", 0, 0, "os9x", False),
+	("boot file", "boot.bin", 0, 1, "os9x", True),
+]
+
+def snapshot(db):
+	if db is None:
+		return None
+	result = {}
+	for field in FIELDS:
+		value = getattr(db, field, None)
+		if isinstance(value, bytearray):
+			value = bytes(value)
+		elif isinstance(value, set):
+			value = sorted(value)
+		result[field] = value
+	return result
+
+# fields that differ, or what each did if not both loaded (None: not accepted, str: exception).
+# if added, netnodes only b has are not counted (information added since a).
+def compare(a, b, added=False):
+	if isinstance(a, dict) and isinstance(b, dict):
+		if added:
+			b = dict(b, blobs=dict([(k, v) for (k, v) in b["blobs"].items() if k in a["blobs"]]))
+		return [field for field in FIELDS if a.get(field) != b.get(field)]
+	if a == b:
+		return []
+	return ["%s / %s" % tuple(["loaded" if isinstance(x, dict) else x for x in (a, b)])]
+
+# child: loads the cases with loaders in loaderdir (before this directory), without the plan cache.
+def loadall(loaderdir, path, out):
+	sys.modules["os9cache"] = None
+	sys.path[0:0] = [loaderdir, HERE]
+	import os9headless
+	results = {}
+	for (label, name, choice, n, loader, _) in CASES:
+		try:
+			results[label] = snapshot(os9headless.run(os.path.join(path, name), choice, [loader], n))
+		except Exception as e:
+			results[label] = "%s: %s" % (type(e).__name__, e)
+	with open(out, "wb") as f:
+		pickle.dump(results, f, 2)
+
+# snapshots of the cases loaded in a child process by loaders in loaderdir, on its own copy of samples.
+def loadchild(loaderdir, path, work, tag):
+	copy = os.path.join(work, tag)
+	shutil.copytree(path, copy)
+	out = os.path.join(work, tag + ".pickle")
+	with open(os.devnull, "w") as null:
+		subprocess.check_call([sys.executable, os.path.abspath(__file__), "--child", loaderdir, copy, out], stdout=null)
+	with open(out, "rb") as f:
+		return pickle.load(f)
+
+# the first commit of the repository, whose loaders are the baseline.
+def firstcommit():
+	with open(os.devnull, "w") as null:
+		return subprocess.check_output(["git", "rev-list", "--max-parents=0", "HEAD"], cwd=HERE, stderr=null).decode("latin-1").split()[-1]
+
+# *.py of rev (except os9headless.py; the stand-in is this one for both) into path.
+def checkout(rev, path):
+	os.mkdir(path)
+	with open(os.devnull, "w") as null:
+		names = subprocess.check_output(["git", "ls-tree", "--name-only", rev], cwd=HERE, stderr=null).decode("latin-1").split()
+	for name in names:
+		if name.endswith(".py") and name not in ["os9headless.py", "os9regress.py"]:
+			with open(os.path.join(path, name), "wb") as f:
+				f.write(subprocess.check_output(["git", "show", "%s:%s" % (rev, name)], cwd=HERE))
+
+# DebugSection at text of dbg.r in db is where DEBUG is in the file.
+def checkdebug(os9headless, os9rl, db, path):
+	with open(path, "rb") as f:
+		pos = f.read().find(DEBUG)
+	os9headless.Database.current = db
+	try:
+		section = os9rl.debugat(db.eas["dbgfn"])
+	finally:
+		os9headless.Database.current = None
+	if section is None or (section.pos, section.size) != (pos, len(DEBUG)) or section.read(0, len(DEBUG)) != DEBUG:
+		return ["debugat %r, not at 0x%X" % (section, pos)]
+	if (pos, len(DEBUG)) not in [(s.pos, s.size) for s in os9rl.debugsections(path)]:
+		return ["debugsections %r, not at 0x%X" % (os9rl.debugsections(path), pos)]
+	return []
+
+# loading through the plan cache (miss, then hit) is the same as without it. (label, problems)
+def checkcache(path, cachedir):
+	os.environ["OS9CACHE"] = cachedir
+	import os9headless
+	import os9cache
+	results = []
+	def run(name, choice, n, loader, cache=True):
+		module = os9headless.loader(loader)
+		saved = module.os9cache
+		if not cache:
+			module.os9cache = None
+		try:
+			return os9headless.run(os.path.join(path, name), choice, [loader], n)
+		finally:
+			module.os9cache = saved
+	def hits():
+		return os9cache.PlanCache.open().hits
+	cases = CASES + [("library member at other offset", "lib2.l", 3, 0, "os9rl", True)]
+	for (label, name, choice, n, loader, _) in cases:
+		before = hits()
+		dbs = [run(name, choice, n, loader, cache) for cache in [True, True, False]]
+		problems = []
+		if hits() - before != (2 if label.endswith("other offset") else 1):
+			problems.append("%d hits" % (hits() - before))
+		for (what, db) in [("hit", dbs[1]), ("no cache", dbs[2])]:
+			problems += ["%s %s" % (what, field) for field in compare(snapshot(dbs[0]), snapshot(db))]
+		for db in dbs:
+			if db is not None and "dbgfn" in db.eas:
+				problems += [p for p in checkdebug(os9headless, os9headless.loader("os9rl"), db, os.path.join(path, name)) if p not in problems]
+		results.append(("cache: " + label, problems))
+	return results
+
+# accept_file of ROF magic then a long name without NUL is rejected after reading only a bounded head.
+def checkprobe(path, size=0x1000000):
+	import os9headless
+	os9rl = os9headless.loader("os9rl")
+	name = os.path.join(path, "longname.r")
+	with open(name, "wb") as f:
+		f.write(b'\xDE\xAD\xFA\xCE' + b'A' * size)
+	li = os9headless.MmapInput(name)
+	try:
+		start = time.time()
+		formats = [os9rl.accept_file(li, n) for n in [0, 1]]
+		elapsed = time.time() - start
+	finally:
+		li.close()
+	os.remove(name)
+	problems = ["accepted as %r" % (format,) for format in formats if format]
+	if elapsed > 0.5:
+		problems.append("%.2fs" % elapsed)
+	return [("probe: name without NUL", problems)]
+
+def main(args):
+	parser = argparse.ArgumentParser(description="compare databases of OS-9/68000 loaders with a git revision of them, and with the plan cache")
+	parser.add_argument("-r", "--rev", help="git revision to compare with (default: the first commit; its loaders run only under Python 2)")
+	parser.add_argument("-k", "--keep", help="work in DIR (not existing yet) and keep it, samples too")
+	parser.add_argument("--child", nargs=3, metavar=("LOADERDIR", "SAMPLEDIR", "OUT"), help=argparse.SUPPRESS)
+	opts = parser.parse_args(args)
+
+	if opts.child:
+		loadall(*opts.child)
+		return 0
+
+	if opts.rev is None and sys.version_info[0] >= 3:
+		print("os9regress: loaders of the first commit run only under Python 2; run with python2 or give -r", file=sys.stderr)
+	work = opts.keep or tempfile.mkdtemp(prefix="os9regress")
+	try:
+		if not os.path.isdir(work):
+			os.makedirs(work)
+		path = os.path.join(work, "samples")
+		os.mkdir(path)
+		# os9link imports os9rl; it is to be the one against the stand-in idaapi
+		import os9headless
+		os9headless.loader("os9rl")
+		samples(path)
+
+		try:
+			rev = opts.rev or firstcommit()
+			checkout(rev, os.path.join(work, "rev"))
+		except (subprocess.CalledProcessError, OSError):
+			results = [(opts.rev or "first commit", ["cannot check out"], None)]
+		else:
+			results = []
+			current = loadchild(HERE, path, work, "current")
+			baseline = loadchild(os.path.join(work, "rev"), path, work, "baseline")
+			for (label, _, _, _, _, new) in CASES:
+				(a, b) = (baseline[label], current[label])
+				if new and not isinstance(a, dict):
+					results.append(("%s: %s" % (rev[:12], label), [], "not loaded by %s: %s" % (rev[:12], a or "not accepted")))
+				else:
+					results.append(("%s: %s" % (rev[:12], label), compare(a, b, True), None))
+		results += [(label, problems, None) for (label, problems) in checkcache(path, os.path.join(work, "cache")) + checkprobe(work)]
+	finally:
+		if not opts.keep:
+			shutil.rmtree(work, ignore_errors=True)
+
+	failed = 0
+	for (label, problems, note) in results:
+		print("%-50s %s" % (label, ", ".join(problems) if problems else note or "ok"))
+		failed += 1 if problems else 0
+	print("%d checks, %d differ" % (len(results), failed))
+	return 1 if failed else 0
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,198 @@
+# MIT License
+#
+# Copyright (c) 2021 Murachue
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# OS-9/68000 module scanner for raw memory dumps and disc images.
+# usage: python os9scan.py [-j JOBS] [--json] [--bad-crc] [-x DIR] IMAGE...
+
+from __future__ import print_function
+import os
+import sys
+import json
+import mmap
+import time
+import struct
+import argparse
+import multiprocessing
+
+import os9x
+
+SYNC = b'\x4A\xFC'
+HEADER = struct.Struct('>HHIIIHBBBBH') # up to M$Edit
+CHUNK = 0x1000000
+EXTRACTCHUNK = 0x100000
+
+TYPES = {
+	1: "Prgm",
+	2: "Sbrtn",
+	3: "Multi",
+	4: "Data",
+	5: "CSDData",
+	11: "TrapLib",
+	12: "Systm",
+	13: "Flmgr",
+	14: "Drivr",
+	15: "Devic",
+}
+LANGS = {
+	0: "-",
+	1: "Objct",
+	2: "ICode",
+	3: "PCode",
+	4: "CCode",
+	5: "CblCode",
+	6: "FtrnCode",
+}
+
+def openmap(path):
+	with open(path, "rb") as f:
+		return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+# validate a candidate at offset. returns catalog entry dict or None.
+def probe(m, offset, checkcrc=True, badcrc=False):
+	if offset + 48 > len(m):
+		return None
+	head = m[offset:offset + 48]
+	if os9x.parity(head) != 0:
+		return None
+	(_, _, size, _, nameoff, _, mtype, lang, _, _, edition) = HEADER.unpack_from(head)
+	if size < 48 + 3 or offset + size > len(m):
+		return None
+
+	crcok = None
+	if checkcrc:
+		crcok = os9x.crc24(m[offset:offset + size]) == os9x.CRC_GOOD
+		if not crcok and not badcrc:
+			return None
+
+	name = None
+	if 48 <= nameoff < size:
+		end = m.find(b'\0', offset + nameoff, offset + size)
+		if end != -1:
+			name = m[offset + nameoff:end].decode("latin-1")
+
+	return {
+		"offset": offset,
+		"size": size,
+		"name": name,
+		"type": TYPES.get(mtype, mtype),
+		"lang": LANGS.get(lang, lang),
+		"edition": edition,
+		"crc": crcok,
+	}
+
+# all valid modules whose sync word starts in [start, end).
+def scanrange(path, start, end, checkcrc=True, badcrc=False):
+	m = openmap(path)
+	try:
+		found = []
+		# +1 to catch sync word crossing the end.
+		limit = min(end + 1, len(m))
+		pos = m.find(SYNC, start, limit)
+		while pos != -1:
+			entry = probe(m, pos, checkcrc, badcrc)
+			if entry is not None:
+				found.append(entry)
+			pos = m.find(SYNC, pos + 1, limit)
+		return found
+	finally:
+		m.close()
+
+def _scanrange(args):
+	return scanrange(*args)
+
+# catalog of modules in an image, split into chunks processed by a pool.
+# modules inside a former module (ex. false positive in data) are dropped unless nested.
+def scan(path, jobs=None, checkcrc=True, badcrc=False, nested=False, chunk=CHUNK):
+	size = os.path.getsize(path)
+	if size == 0:
+		return []
+	ranges = [(path, start, min(start + chunk, size), checkcrc, badcrc) for start in range(0, size, chunk)]
+	if len(ranges) == 1 or jobs == 1:
+		results = [_scanrange(r) for r in ranges]
+	else:
+		pool = multiprocessing.Pool(jobs)
+		try:
+			results = pool.map(_scanrange, ranges)
+		finally:
+			pool.close()
+			pool.join()
+
+	catalog = []
+	end = 0
+	for found in results:
+		for entry in found:
+			if nested or entry["offset"] >= end:
+				catalog.append(entry)
+				end = max(end, entry["offset"] + entry["size"])
+	return catalog
+
+# write a module out of image, straight from the map (by slices of it on Python 2, its mmap has no buffer interface).
+def extract(m, entry, path):
+	(start, end) = (entry["offset"], entry["offset"] + entry["size"])
+	with open(path, "wb") as f:
+		try:
+			f.write(memoryview(m)[start:end])
+		except TypeError:
+			for pos in range(start, end, EXTRACTCHUNK):
+				f.write(m[pos:min(pos + EXTRACTCHUNK, end)])
+
+def main(args):
+	parser = argparse.ArgumentParser(description="find OS-9/68000 modules in images")
+	parser.add_argument("images", nargs="+")
+	parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes (default: cpu count)")
+	parser.add_argument("--json", action="store_true", help="output catalog as JSON lines")
+	parser.add_argument("--no-crc", action="store_true", help="do not check CRC (parity and size only)")
+	parser.add_argument("--bad-crc", action="store_true", help="also list modules with bad CRC")
+	parser.add_argument("--nested", action="store_true", help="also list modules inside another one")
+	parser.add_argument("-x", "--extract", metavar="DIR", help="extract modules into DIR")
+	opts = parser.parse_args(args)
+
+	total = 0
+	start = time.time()
+	for path in opts.images:
+		catalog = scan(path, opts.jobs, not opts.no_crc, opts.bad_crc, opts.nested)
+		total += os.path.getsize(path)
+		for entry in catalog:
+			if opts.json:
+				entry = dict(entry, image=path)
+				print(json.dumps(entry, sort_keys=True))
+			else:
+				print("%s %08X %08X %-8s %-8s %5d %s %s" % (
+					path, entry["offset"], entry["size"], entry["type"], entry["lang"], entry["edition"],
+					{None: "-", True: "ok", False: "BAD"}[entry["crc"]], entry["name"],
+				))
+		if opts.extract and catalog:
+			if not os.path.isdir(opts.extract):
+				os.makedirs(opts.extract)
+			m = openmap(path)
+			try:
+				for entry in catalog:
+					name = "%s_%08X_%s" % (os.path.basename(path), entry["offset"], (entry["name"] or "noname").replace("/", "_"))
+					extract(m, entry, os.path.join(opts.extract, name))
+			finally:
+				m.close()
+	elapsed = time.time() - start
+	print("%d bytes scanned in %.3fs (%.2f MB/s)" % (total, elapsed, total / 1e6 / max(elapsed, 1e-9)), file=sys.stderr)
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,433 @@
+# MIT License
+#
+# Copyright (c) 2021 Murachue
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Signature database of library code, to find library functions in linked modules.
+# usage: python os9sig.py [-d DIR] build LIB.L...
+#        python os9sig.py [-d DIR] info
+#        python os9sig.py [-d DIR] match MODULE...
+#
+# a signature is text of a library member, with bytes patched at link time (relocations and import references) masked.
+# DIR has manifest.json (libraries and their hashes) and shards XX.sig, keyed by the first byte of anchor
+# (first stable ANCHOR bytes of the text), to be loaded lazily.
+
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import zlib
+import struct
+import bisect
+import hashlib
+import argparse
+from array import array
+
+import os9rl
+
+ANCHOR = 4
+MINSTABLE = 16 # members with less stable bytes are too ambiguous to be matched
+SHARDMAGIC = b'OS9SIG01'
+
+def defaultpath():
+	return os.environ.get("OS9SIGDB") or os.path.join(os.path.expanduser("~"), ".os9sig")
+
+# CRC of pattern (masked bytes must be zero)
+def crc(data):
+	return zlib.crc32(bytes(data)) & 0xFFFFffff
+
+class Signature(object):
+	__slots__ = ("library", "offset", "name", "pattern", "masks", "anchoroff", "crc", "exports")
+
+	_struct = struct.Struct('>HIIIIHH')
+	MASK = struct.Struct('>IB')
+	EXPORT = struct.Struct('>I')
+
+	def __init__(self, library, offset, name, pattern, masks, anchoroff, crc, exports):
+		self.library = library # number in manifest
+		self.offset = offset # of member in library
+		self.name = name # of member
+		self.pattern = pattern # text, masked bytes are zero
+		self.masks = masks # [(offset, width)]
+		self.anchoroff = anchoroff
+		self.crc = crc
+		self.exports = exports # [(name, offset in text)]
+
+	@property
+	def length(self):
+		return len(self.pattern)
+
+	def anchor(self):
+		return self.pattern[self.anchoroff:self.anchoroff + ANCHOR]
+
+	# from text and [(offset, width)] patched at link time; None if not distinctive enough.
+	@classmethod
+	def make(cls, library, offset, name, text, masks, exports):
+		pattern = bytearray(text)
+		stable = bytearray(b'\1') * len(pattern)
+		for (off, width) in masks:
+			pattern[off:off + width] = b'\0' * len(pattern[off:off + width])
+			stable[off:off + width] = b'\0' * len(stable[off:off + width])
+		if stable.count(b'\1') < MINSTABLE:
+			return None
+		anchoroff = bytes(stable).find(b'\1' * ANCHOR)
+		if anchoroff == -1:
+			return None
+		return cls(library, offset, name, bytes(pattern), sorted(set(masks)), anchoroff, crc(pattern), exports)
+
+	# data matches at start? (anchor is already known to match)
+	def matches(self, data, start):
+		candidate = bytearray(data[start:start + len(self.pattern)])
+		if len(candidate) < len(self.pattern):
+			return False
+		for (off, width) in self.masks:
+			candidate[off:off + width] = b'\0' * len(candidate[off:off + width])
+		return crc(candidate) == self.crc
+
+	def pack(self):
+		return b''.join([
+			self._struct.pack(self.library, self.offset, len(self.pattern), self.anchoroff, self.crc, len(self.masks), len(self.exports)),
+			self.pattern,
+			b''.join([self.MASK.pack(off, width) for (off, width) in self.masks]),
+			os9rl.tobytes(self.name) + b'\0',
+			b''.join([os9rl.tobytes(name) + b'\0' + self.EXPORT.pack(off) for (name, off) in self.exports]),
+		])
+
+	# returns (signature, next offset)
+	@classmethod
+	def unpack(cls, buf, off):
+		(library, offset, length, anchoroff, crc, nmasks, nexports) = cls._struct.unpack_from(buf, off)
+		off += cls._struct.size
+		pattern = bytes(buf[off:off + length])
+		off += length
+		masks = []
+		for _ in range(nmasks):
+			masks.append(cls.MASK.unpack_from(buf, off))
+			off += cls.MASK.size
+		end = buf.index(b'\0', off)
+		name = os9rl.tostr(buf[off:end])
+		off = end + 1
+		exports = []
+		for _ in range(nexports):
+			end = buf.index(b'\0', off)
+			exports.append((os9rl.tostr(buf[off:end]), cls.EXPORT.unpack_from(buf, end + 1)[0]))
+			off = end + 1 + cls.EXPORT.size
+		return (cls(library, offset, name, pattern, masks, anchoroff, crc, exports), off)
+
+# signatures of members of library (or an object) f.
+def scan(f, library):
+	f.seek(0)
+	r = os9rl.Reader(f)
+	sigs = []
+	for part in walk(r):
+		end = r.tell()
+		masks = [(addr, kind.width) for (kind, addrs) in part.relocs.groups().items() if kind.writesegment == "text" for addr in addrs]
+		for sym in part.imports.entries:
+			masks.extend([(addr, kind.width) for (kind, addrs) in sym.groups().items() if kind.writesegment == "text" for addr in addrs])
+		exports = [(sym.name, sym.addr) for sym in part.exports.entries if sym.segment() == "text"]
+		r.seek(part.textpos)
+		sig = Signature.make(library, part.offset, part.header.name, r.read(part.header.textsize), masks, exports)
+		if sig is not None:
+			sigs.append(sig)
+		r.seek(end)
+	return sigs
+
+# os9rl.walk stopping at broken object
+def walk(r):
+	try:
+		for part in os9rl.walk(r):
+			yield part
+	except EOFError:
+		pass
+
+# sha1 of file as LibraryIndex does
+def digest(path):
+	with open(path, "rb") as f:
+		return os9rl.LibraryIndex.hash(f)
+
+# Finds signatures in data in one pass: a hash table of anchors (as 32bit words) looked up at every possible
+# anchor position, then verified by masked CRC. functions are word aligned, so anchors at odd offsets
+# are looked up only if some signature has one.
+# the table is cached in the database (matcher.bin), so signatures are read only when their anchor is seen.
+class Matcher(object):
+	MAGIC = b'OS9SIGM1'
+	_struct = struct.Struct('>8s20sIB')
+
+	def __init__(self, db, anchors, keys, indexes, odd):
+		self.db = db
+		self.odd = odd # some signature has anchor at odd offset
+		self.anchors = anchors # array('I'): anchor as big endian word
+		self.keys = keys # array('B'): shard of signature
+		self.indexes = indexes # array('I'): index of signature in shard
+		self.table = {} # anchor -> [(key, index)]
+		for (anchor, key, index) in zip(anchors, keys, indexes):
+			self.table.setdefault(anchor, []).append((key, index))
+
+	@classmethod
+	def build(cls, db):
+		(anchors, keys, indexes) = (array('I'), array('B'), array('I'))
+		odd = False
+		for key in range(256):
+			for (index, sig) in enumerate(db.shard(key)):
+				anchors.append(struct.unpack('>I', sig.anchor())[0])
+				keys.append(key)
+				indexes.append(index)
+				odd = odd or (sig.anchoroff & 1) != 0
+		return cls(db, anchors, keys, indexes, odd)
+
+	@staticmethod
+	def _be(a):
+		if sys.byteorder == 'little':
+			a.byteswap()
+		return a
+
+	@classmethod
+	def read(cls, db, path, stamp):
+		with open(path, "rb") as f:
+			buf = f.read()
+		(magic, filestamp, count, odd) = cls._struct.unpack_from(buf, 0)
+		if magic != cls.MAGIC or filestamp != stamp:
+			raise ValueError("stale")
+		off = cls._struct.size
+		anchors = cls._be(array('I', buf[off:off + 4 * count]))
+		off += 4 * count
+		keys = array('B', buf[off:off + count])
+		off += count
+		indexes = cls._be(array('I', buf[off:off + 4 * count]))
+		return cls(db, anchors, keys, indexes, odd != 0)
+
+	def write(self, path, stamp):
+		with open(path, "wb") as f:
+			f.write(self._struct.pack(self.MAGIC, stamp, len(self.anchors), 1 if self.odd else 0))
+			for a in [self._be(array('I', self.anchors)), self.keys, self._be(array('I', self.indexes))]:
+				f.write(a.tostring() if str is bytes else a.tobytes())
+
+	def signatures(self, anchor):
+		return [self.db.shard(key)[index] for (key, index) in self.table[anchor]]
+
+	# [(offset, Signature)] found in data, not overlapping; longer one wins.
+	def scan(self, data):
+		table = self.table
+		found = []
+		for phase in ([0, 1, 2, 3] if self.odd else [0, 2]):
+			n = (len(data) - phase) // 4
+			if n <= 0:
+				continue
+			words = self._be(array('I', bytes(data[phase:phase + 4 * n])))
+			for i in [i for (i, word) in enumerate(words) if word in table]:
+				pos = phase + 4 * i
+				for sig in self.signatures(words[i]):
+					start = pos - sig.anchoroff
+					if start >= 0 and (start & 1) == 0 and sig.matches(data, start):
+						found.append((start, sig))
+		found.sort(key=lambda m: (-m[1].length, m[0]))
+		# taken ranges are disjoint; sorted by start, thus by end too.
+		starts = []
+		ends = []
+		result = []
+		for (start, sig) in found:
+			end = start + sig.length
+			i = bisect.bisect_right(starts, start)
+			if (i > 0 and ends[i - 1] > start) or (i < len(starts) and starts[i] < end):
+				continue
+			starts.insert(i, start)
+			ends.insert(i, end)
+			result.append((start, sig))
+		result.sort(key=lambda m: m[0])
+		return result
+
+# Signature database directory. libraries are re-scanned only when their size and content hash changed
+# (mtime is a shortcut to skip hashing, as LibraryIndex does).
+class SignatureDB(object):
+	def __init__(self, path=None):
+		self.path = path or defaultpath()
+		self.manifest = {"libraries": {}, "next": 0} # libraries: path -> {size, mtime, sha1, id}
+		try:
+			with open(os.path.join(self.path, "manifest.json")) as f:
+				self.manifest = json.load(f)
+		except (IOError, OSError, ValueError):
+			pass
+		self.shards = {} # key -> [Signature]; loaded on demand
+		self.paths = dict((lib["id"], path) for (path, lib) in self.manifest["libraries"].items())
+
+	@staticmethod
+	def key(anchor):
+		return bytearray(anchor[0:1])[0]
+
+	def shardpath(self, key):
+		return os.path.join(self.path, "%02X.sig" % key)
+
+	def shard(self, key):
+		sigs = self.shards.get(key)
+		if sigs is None:
+			sigs = self.shards[key] = self.readshard(key)
+		return sigs
+
+	def readshard(self, key):
+		try:
+			with open(self.shardpath(key), "rb") as f:
+				buf = f.read()
+		except (IOError, OSError):
+			return []
+		if buf[:len(SHARDMAGIC)] != SHARDMAGIC:
+			return []
+		(count,) = struct.unpack_from('>I', buf, len(SHARDMAGIC))
+		off = len(SHARDMAGIC) + 4
+		sigs = []
+		for _ in range(count):
+			(sig, off) = Signature.unpack(buf, off)
+			sigs.append(sig)
+		return sigs
+
+	def writeshard(self, key, sigs):
+		path = self.shardpath(key)
+		if not sigs:
+			if os.path.exists(path):
+				os.remove(path)
+			return
+		with open(path, "wb") as f:
+			f.write(SHARDMAGIC + struct.pack('>I', len(sigs)))
+			f.write(b''.join([sig.pack() for sig in sigs]))
+
+	# all signatures (loads every shard)
+	def all(self):
+		sigs = []
+		for key in range(256):
+			sigs.extend(self.shard(key))
+		return sigs
+
+	def library(self, sig):
+		return self.paths.get(sig.library)
+
+	# None if there is no database.
+	@classmethod
+	def open(cls, path=None):
+		path = path or defaultpath()
+		if not os.path.exists(os.path.join(path, "manifest.json")):
+			return None
+		return cls(path)
+
+	# identifies content of database; changes only when some library is (re)scanned or dropped.
+	def stamp(self):
+		libs = sorted([(lib["id"], lib["sha1"]) for lib in self.manifest["libraries"].values()])
+		return hashlib.sha1(json.dumps(libs).encode("ascii")).digest()
+
+	# Matcher from cache, or built (reading all shards) and cached.
+	def matcher(self):
+		path = os.path.join(self.path, "matcher.bin")
+		stamp = self.stamp()
+		try:
+			return Matcher.read(self, path, stamp)
+		except (IOError, OSError, ValueError, struct.error):
+			pass
+		matcher = Matcher.build(self)
+		try:
+			matcher.write(path, stamp)
+		except (IOError, OSError):
+			pass # read-only place? just not cache.
+		return matcher
+
+	# add or refresh libraries, drop ones not existing anymore. returns number of libraries scanned.
+	def update(self, paths):
+		if not os.path.isdir(self.path):
+			os.makedirs(self.path)
+		libs = self.manifest["libraries"]
+		changed = {} # id -> new signatures
+		dropped = set()
+		for path in [os.path.abspath(path) for path in paths]:
+			st = os.stat(path)
+			lib = libs.get(path)
+			if lib is not None and lib["size"] == st.st_size and lib["mtime"] == st.st_mtime:
+				continue
+			sha1 = "".join(["%02x" % b for b in bytearray(digest(path))])
+			if lib is not None and lib["size"] == st.st_size and lib["sha1"] == sha1:
+				lib["mtime"] = st.st_mtime
+				continue
+			if lib is None:
+				lib = libs[path] = {"id": self.manifest["next"]}
+				self.manifest["next"] += 1
+			lib.update(size=st.st_size, mtime=st.st_mtime, sha1=sha1)
+			with open(path, "rb") as f:
+				changed[lib["id"]] = scan(f, lib["id"])
+		for path in list(libs):
+			if not os.path.exists(path):
+				dropped.add(libs.pop(path)["id"])
+		self.paths = dict((lib["id"], path) for (path, lib) in libs.items())
+
+		if changed or dropped:
+			stale = set(changed) | dropped
+			fresh = {}
+			for sigs in changed.values():
+				for sig in sigs:
+					fresh.setdefault(self.key(sig.anchor()), []).append(sig)
+			for key in range(256):
+				old = self.shard(key)
+				sigs = [sig for sig in old if sig.library not in stale] + fresh.get(key, [])
+				if len(sigs) != len(old) or key in fresh:
+					self.writeshard(key, sigs)
+				self.shards[key] = sigs
+
+		with open(os.path.join(self.path, "manifest.json"), "w") as f:
+			json.dump(self.manifest, f, indent=1, sort_keys=True)
+		return len(changed)
+
+def main(args):
+	parser = argparse.ArgumentParser(description="build signature database of OS-9/68000 library code")
+	parser.add_argument("-d", "--db", help="database directory (default: $OS9SIGDB or ~/.os9sig)")
+	sub = parser.add_subparsers(dest="command")
+	sub.required = True
+	p = sub.add_parser("build", help="add or refresh libraries")
+	p.add_argument("libraries", nargs="+")
+	p = sub.add_parser("info", help="show what is in the database")
+	p = sub.add_parser("match", help="find library members in modules")
+	p.add_argument("modules", nargs="+")
+	opts = parser.parse_args(args)
+
+	db = SignatureDB(opts.db)
+	if opts.command == "build":
+		start = time.time()
+		n = db.update(opts.libraries)
+		print("%d of %d libraries scanned in %.3fs" % (n, len(opts.libraries), time.time() - start), file=sys.stderr)
+	elif opts.command == "match":
+		start = time.time()
+		matcher = db.matcher()
+		print("matcher ready in %.3fs" % (time.time() - start), file=sys.stderr)
+		for path in opts.modules:
+			with open(path, "rb") as f:
+				data = f.read()
+			start = time.time()
+			matches = matcher.scan(data)
+			elapsed = max(time.time() - start, 1e-9)
+			for (off, sig) in matches:
+				print("%s: %08X %s(%s) %s" % (path, off, os.path.basename(db.library(sig) or "?"), sig.name, " ".join([name for (name, _) in sig.exports])))
+			print("%s: %d matches in %.3fs (%.0f matches/s, %.2f MB/s)" % (
+				path, len(matches), elapsed, len(matches) / elapsed, len(data) / 1e6 / elapsed), file=sys.stderr)
+	elif opts.command == "info":
+		sigs = db.all()
+		for (path, lib) in sorted(db.manifest["libraries"].items()):
+			print("%s: %d signatures" % (path, sum([1 for sig in sigs if sig.library == lib["id"]])))
+		print("%d signatures, %d bytes of patterns, %d exports" % (
+			len(sigs), sum([sig.length for sig in sigs]), sum([len(sig.exports) for sig in sigs])))
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
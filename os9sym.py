@@ -0,0 +1,206 @@
+# MIT License
+#
+# Copyright (c) 2021 Murachue
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Global symbol index of OS9C toolchain libraries: which library member exports (or imports) a symbol.
+# usage: python os9sym.py [--db DB] update LIB.L...
+#        python os9sym.py [--db DB] lookup SYMBOL...
+#        python os9sym.py [--db DB] refs SYMBOL...
+#
+#   import os9sym
+#   os9sym.SymbolIndex.open().lookup("printf")
+
+from __future__ import print_function
+import os
+import sys
+import time
+import sqlite3
+import argparse
+
+import os9rl
+
+# where the index is by default (also what os9rl.py looks for)
+def defaultpath():
+	return os.environ.get("OS9SYMDB") or os.path.join(os.path.expanduser("~"), ".os9sym.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS libraries (id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL, size INTEGER NOT NULL, mtime REAL NOT NULL, digest BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS members (id INTEGER PRIMARY KEY, library INTEGER NOT NULL, offset INTEGER NOT NULL, name TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS exports (name TEXT NOT NULL, member INTEGER NOT NULL, segment TEXT NOT NULL, addr INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS imports (name TEXT NOT NULL, member INTEGER NOT NULL, nrefs INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS exports_name ON exports (name);
+CREATE INDEX IF NOT EXISTS imports_name ON imports (name);
+CREATE INDEX IF NOT EXISTS members_library ON members (library);
+"""
+
+# (offset, name, [(export name, segment, addr)], [(import name, number of references)]) of a member
+def member(part):
+	return (part.offset, part.header.name, [(sym.name, sym.segment(), sym.addr) for sym in part.exports.entries], part.imports)
+
+class Definition(object):
+	__slots__ = ("symbol", "library", "offset", "member", "segment", "addr")
+
+	def __init__(self, symbol, library, offset, member, segment, addr):
+		self.symbol = symbol
+		self.library = library
+		self.offset = offset
+		self.member = member
+		self.segment = segment
+		self.addr = addr
+
+	def __str__(self):
+		return "%s(%s@%X) %s:%X" % (os.path.basename(self.library), self.member, self.offset, self.segment, self.addr)
+
+# Persistent index on SQLite. a library is re-scanned only when its size or content hash changed
+# (mtime is a shortcut to skip hashing, as LibraryIndex does).
+class SymbolIndex(object):
+	def __init__(self, db):
+		self.db = db
+		if str is bytes:
+			db.text_factory = str # native str names on Python 2
+
+	@classmethod
+	def open(cls, path=None, create=True):
+		path = path or defaultpath()
+		if not create and not os.path.exists(path):
+			return None
+		index = cls(sqlite3.connect(path))
+		index.db.executescript(SCHEMA)
+		return index
+
+	def close(self):
+		self.db.close()
+
+	# returns True if (re)indexed, False if up to date.
+	def update(self, path):
+		path = os.path.abspath(path)
+		st = os.stat(path)
+		row = self.db.execute("SELECT id, size, mtime, digest FROM libraries WHERE path = ?", (path,)).fetchone()
+		if row is not None and row[1] == st.st_size and row[2] == st.st_mtime:
+			return False
+
+		f = open(path, "rb")
+		try:
+			digest = os9rl.LibraryIndex.hash(f)
+			if row is not None and row[1] == st.st_size and bytes(row[3]) == digest:
+				# only touched
+				with self.db:
+					self.db.execute("UPDATE libraries SET mtime = ? WHERE id = ?", (st.st_mtime, row[0]))
+				return False
+
+			f.seek(0)
+			members = []
+			try:
+				for part in os9rl.walk(os9rl.Reader(f), False):
+					members.append(member(part))
+			except EOFError:
+				pass
+		finally:
+			f.close()
+
+		with self.db:
+			if row is not None:
+				self.remove(row[0])
+			libid = self.db.execute("INSERT INTO libraries (path, size, mtime, digest) VALUES (?, ?, ?, ?)",
+				(path, st.st_size, st.st_mtime, sqlite3.Binary(digest))).lastrowid
+			for (offset, name, exports, imports) in members:
+				memid = self.db.execute("INSERT INTO members (library, offset, name) VALUES (?, ?, ?)", (libid, offset, name)).lastrowid
+				self.db.executemany("INSERT INTO exports (name, member, segment, addr) VALUES (?, ?, ?, ?)",
+					[(sym, memid, segment, addr) for (sym, segment, addr) in exports])
+				self.db.executemany("INSERT INTO imports (name, member, nrefs) VALUES (?, ?, ?)",
+					[(sym, memid, n) for (sym, n) in imports])
+		return True
+
+	def remove(self, libid):
+		self.db.execute("DELETE FROM exports WHERE member IN (SELECT id FROM members WHERE library = ?)", (libid,))
+		self.db.execute("DELETE FROM imports WHERE member IN (SELECT id FROM members WHERE library = ?)", (libid,))
+		self.db.execute("DELETE FROM members WHERE library = ?", (libid,))
+		self.db.execute("DELETE FROM libraries WHERE id = ?", (libid,))
+
+	# drop libraries that no longer exist.
+	def prune(self):
+		gone = [(libid,) for (libid, path) in self.db.execute("SELECT id, path FROM libraries").fetchall() if not os.path.exists(path)]
+		with self.db:
+			for (libid,) in gone:
+				self.remove(libid)
+		return len(gone)
+
+	# where symbol is defined; list of Definition (can be many; same name in multiple libraries)
+	def lookup(self, symbol):
+		return [Definition(symbol, *row) for row in self.db.execute(
+			"SELECT l.path, m.offset, m.name, e.segment, e.addr FROM exports e JOIN members m ON m.id = e.member JOIN libraries l ON l.id = m.library"
+			" WHERE e.name = ? ORDER BY l.path, m.offset", (symbol,))]
+
+	# who imports symbol; list of (library, member offset, member name, number of references)
+	def refs(self, symbol):
+		return self.db.execute(
+			"SELECT l.path, m.offset, m.name, i.nrefs FROM imports i JOIN members m ON m.id = i.member JOIN libraries l ON l.id = m.library"
+			" WHERE i.name = ? ORDER BY l.path, m.offset", (symbol,)).fetchall()
+
+def main(args):
+	parser = argparse.ArgumentParser(description="index exported/imported symbols of OS-9/68000 libraries")
+	parser.add_argument("--db", help="index file (default: $OS9SYMDB or ~/.os9sym.db)")
+	sub = parser.add_subparsers(dest="command")
+	sub.required = True
+	p = sub.add_parser("update", help="add or refresh libraries")
+	p.add_argument("libraries", nargs="+")
+	p = sub.add_parser("prune", help="drop libraries that no longer exist")
+	p = sub.add_parser("lookup", help="where symbols are defined")
+	p.add_argument("symbols", nargs="+")
+	p = sub.add_parser("refs", help="who imports symbols")
+	p.add_argument("symbols", nargs="+")
+	opts = parser.parse_args(args)
+
+	index = SymbolIndex.open(opts.db)
+	try:
+		status = 0
+		if opts.command == "update":
+			start = time.time()
+			n = 0
+			for path in opts.libraries:
+				if index.update(path):
+					n += 1
+			print("%d of %d libraries indexed in %.3fs" % (n, len(opts.libraries), time.time() - start), file=sys.stderr)
+		elif opts.command == "prune":
+			print("%d libraries dropped" % index.prune(), file=sys.stderr)
+		elif opts.command == "lookup":
+			for symbol in opts.symbols:
+				defs = index.lookup(symbol)
+				if not defs:
+					status = 1
+					print("%s: not found" % symbol)
+				for d in defs:
+					print("%s: %s" % (symbol, d))
+		elif opts.command == "refs":
+			for symbol in opts.symbols:
+				refs = index.refs(symbol)
+				if not refs:
+					status = 1
+					print("%s: not found" % symbol)
+				for (path, offset, member, nrefs) in refs:
+					print("%s: %s(%s@%X) x%d" % (symbol, os.path.basename(path), member, offset, nrefs))
+		return status
+	finally:
+		index.close()
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
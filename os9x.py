@@ -21,11 +21,32 @@
 # SOFTWARE.
 
 # OS-9/68000 Executable File Loader for IDA 6.9 (old!)
+# can be also run from command line to validate modules: python os9x.py FILE...
 
+from __future__ import print_function
+import os
+import sys
+import time
 import struct
-import idaapi
+from array import array
+from functools import reduce
+try:
+	import idaapi
+	Choose2 = idaapi.Choose2
+except ImportError:
+	# command line
+	idaapi = None
+	Choose2 = object
+# load plan cache (os9cache.py), if importable
+try:
+	import os9cache
+except ImportError:
+	os9cache = None
 
 FORMAT_EXE = 'OS-9/68000 Executable'
+FORMAT_EXE_BADCRC = 'OS-9/68000 Executable (bad CRC)'
+FORMAT_BOOT = 'OS-9/68000 Boot file (all modules)'
+FORMAT_BOOT_SELECT = 'OS-9/68000 Boot file (choose modules)'
 
 # TODO: what li.read returns/throws on short-read or EOF? (assuming partial str on short-read, None on EOF)
 def read(li, bytes):
@@ -103,40 +124,76 @@ class Header(LiObject):
 		("parity", readw),
 	]
 
-def accept_file(li, n):
-	# only one format accepted
-	if n != 0:
-		return 0
-
-	li.seek(0)
-
-	if readw(li) != 0x4AFC:
-		return 0
-
-	li.seek(0)
-
-	parity = reduce(lambda a, b: a ^ b, struct.unpack(">24H", li.read(48)), 0xFFFF)
-	if parity != 0:
-		return 0
-
-	# TODO: check CRC24?
-
-	return FORMAT_EXE
-
-def load_file(li, neflags, format):
-	# hey wrong man
-	if format not in [FORMAT_EXE]:
-		return 0
-
-	# requires 68000 processor module. (should be 68070 for CD-i)
-	idaapi.set_processor_type('68000', SETPROC_ALL | SETPROC_FATAL)
-
-	# rewind
-	li.seek(0)
-
-	if readw(li) != 0x4AFC:
-		raise RuntimeError('Wrong magic??')
-	header = Header(li)
+# module CRC: 24bit, x^24+x^23+x^6+x^5+x+1, MSB first, initially 0xFFFFFF.
+# M$CRC is complement of CRC of module before it, thus CRC of whole module is always CRC_GOOD.
+CRC_INIT = 0xFFFFFF
+CRC_GOOD = 0x800FE3
+CRC_POLY = 0x800063
+
+def _crctable():
+	table = []
+	for i in range(256):
+		crc = i << 16
+		for _ in range(8):
+			crc <<= 1
+			if crc & 0x1000000:
+				crc ^= 0x1000000 | CRC_POLY
+		table.append(crc)
+	return table
+CRCTABLE = _crctable()
+_crctable16 = None # 2 bytes at once; built on first large input
+
+class CRC24(object):
+	# below this, building 16bit table does not pay
+	TABLE16_THRESHOLD = 0x40000
+
+	def __init__(self, crc=CRC_INIT):
+		self.crc = crc
+
+	def update(self, data):
+		global _crctable16
+		crc = self.crc
+		start = 0
+		if len(data) >= self.TABLE16_THRESHOLD:
+			if _crctable16 is None:
+				t = CRCTABLE
+				_crctable16 = [((t[i >> 8] << 8) & 0xFFFFFF) ^ t[(t[i >> 8] >> 16) ^ (i & 0xFF)] for i in range(0x10000)]
+			t = _crctable16
+			start = len(data) & ~1
+			words = array('H', data[:start])
+			if sys.byteorder == 'little':
+				words.byteswap()
+			for w in words:
+				crc = ((crc << 16) & 0xFFFFFF) ^ t[(crc >> 8) ^ w]
+		t = CRCTABLE
+		for b in bytearray(data[start:]):
+			crc = ((crc << 8) & 0xFFFFFF) ^ t[(crc >> 16) ^ b]
+		self.crc = crc
+		return self
+
+	# value to be stored after data
+	def stored(self):
+		return ~self.crc & 0xFFFFFF
+
+def crc24(data, crc=CRC_INIT):
+	return CRC24(crc).update(data).crc
+
+# CRC of size bytes from offset, streaming from li.
+def readcrc(li, offset, size, chunk=0x100000):
+	li.seek(offset)
+	crc = CRC24()
+	while size > 0:
+		d = read(li, min(size, chunk))
+		crc.update(d)
+		size -= len(d)
+	return crc
+
+# 0 if header (first 48 bytes) is OK.
+def parity(head):
+	return reduce(lambda a, b: a ^ b, struct.unpack_from(">24H", head), 0xFFFF)
+
+# type specific header after common header: (exec, excpt, mem, stack, idata, irefs, init, term), None if not exists.
+def readexec(li, type):
 	hexec = None
 	hexcpt = None
 	hmem = None
@@ -145,41 +202,214 @@ def load_file(li, neflags, format):
 	hirefs = None
 	hinit = None
 	hterm = None
-	if header.type in [1, 11, 12, 13, 14]: # Prgm, TrapLib, Systm, Flmgr, Drivr
+	if type in [1, 11, 12, 13, 14]: # Prgm, TrapLib, Systm, Flmgr, Drivr
 		hexec = readl(li)
 		hexcpt = readl(li)
-	if header.type in [1, 11, 14]: # Prgm, TrapLib, Drivr
+	if type in [1, 11, 14]: # Prgm, TrapLib, Drivr
 		hmem = readl(li)
-	if header.type in [1, 11]: # Prgm, TrapLib
+	if type in [1, 11]: # Prgm, TrapLib
 		hstack = readl(li)
 		hidata = readl(li)
 		hirefs = readl(li)
-	if header.type in [11]: # TrapLib
+	if type in [11]: # TrapLib
 		hinit = readl(li)
 		hterm = readl(li)
+	return (hexec, hexcpt, hmem, hstack, hidata, hirefs, hinit, hterm)
+
+IREFHEAD = struct.Struct('>HH')
+
+# M$IRefs: data->text block then data->data block,
+# each is repeat of (msword, count, lsword * count) terminated by (0, 0).
+# returns [[(offset, msword, lswords), ..., (offset, 0, None)], [...]]
+def readirefs(li, offset, end):
+	li.seek(offset)
+	buf = read(li, max(end - offset, 0))
+	blocks = []
+	pos = 0
+	try:
+		for _ in range(2):
+			block = []
+			while True:
+				(msword, count) = IREFHEAD.unpack_from(buf, pos)
+				if msword == 0 and count == 0:
+					block.append((offset + pos, 0, None))
+					pos += 4
+					break
+				block.append((offset + pos, msword, struct.unpack_from('>%dH' % count, buf, pos + 4)))
+				pos += 4 + 2 * count
+			blocks.append(block)
+	except struct.error:
+		raise EOFError
+	return blocks
+
+# offsets of modules chained from top of li by M$Size, while each has sync and good header parity (and fits in file).
+def walkchain(li):
+	offsets = []
+	offset = 0
+	size = li.size()
+	while offset + 48 <= size:
+		li.seek(offset)
+		head = li.read(48)
+		if head is None or len(head) < 48 or head[0:2] != b'\x4A\xFC' or parity(head) != 0:
+			break
+		msize = struct.unpack_from(">I", head, 4)[0]
+		if msize < 48 or offset + msize > size:
+			break
+		offsets.append(offset)
+		offset += msize
+	return offsets
+
+def accept_file(li, n):
+	# boot file (modules chained) also can be loaded as a whole, or some of them
+	if n in [1, 2]:
+		try:
+			if len(walkchain(li)) < 2:
+				return 0
+		except EOFError:
+			return 0
+		return [None, FORMAT_BOOT, FORMAT_BOOT_SELECT][n]
+	if n != 0:
+		return 0
 
-	# simply map whole to text (using header)
 	li.seek(0)
+
+	try:
+		if readw(li) != 0x4AFC:
+			return 0
+
+		li.seek(0)
+		head = read(li, 48)
+	except EOFError:
+		return 0
+
+	if parity(head) != 0:
+		return 0
+
+	# still accept damaged/patched module; load_file tells where.
+	try:
+		if readcrc(li, 0, struct.unpack_from(">I", head, 4)[0]).crc != CRC_GOOD:
+			return FORMAT_EXE_BADCRC
+	except EOFError:
+		return FORMAT_EXE_BADCRC
+
+	return FORMAT_EXE
+
+# signature database (os9sig.py) if it is importable and built; None otherwise.
+def signaturedb():
+	try:
+		import os9sig
+		return os9sig.SignatureDB.open()
+	except Exception:
+		return None
+
+# name library functions found in modules by signatures. modules: [(file offset, text ea, size)]
+def matchlibrary(li, modules):
+	db = signaturedb()
+	if db is None:
+		return
+	start = time.time()
+	matcher = db.matcher()
+	(nmatches, names, total) = (0, 0, 0)
+	for (offset, textsegea, size) in modules:
+		li.seek(offset)
+		data = li.read(size) or b''
+		total += len(data)
+		matches = matcher.scan(data)
+		nmatches += len(matches)
+		for (off, sig) in matches:
+			ea = textsegea + off
+			idaapi.set_cmt(ea, "%s(%s)" % (os.path.basename(db.library(sig) or "?"), sig.name), 0)
+			for (name, symoff) in sig.exports:
+				idaapi.add_func(ea + symoff, idaapi.BADADDR)
+				idaapi.set_name(ea + symoff, name, idaapi.SN_CHECK | idaapi.SN_PUBLIC)
+				names += 1
+	elapsed = max(time.time() - start, 1e-9)
+	print("os9x: %d library members (%d functions) matched in %.3fs (%.0f matches/s, %.2f MB/s)" % (
+		nmatches, names, elapsed, nmatches / elapsed, total / 1e6 / elapsed))
+
+# Module in li at offset; headers, and where it is loaded (set by layout).
+class Module(object):
+	def __init__(self, li, offset):
+		li.seek(offset)
+		if readw(li) != 0x4AFC:
+			raise RuntimeError('Wrong magic??')
+		self.offset = offset
+		self.header = Header(li)
+		(self.hexec, self.hexcpt, self.hmem, self.hstack, self.hidata, self.hirefs, self.hinit, self.hterm) = readexec(li, self.header.type)
+		self.name = None
+		if 0 < self.header.name < self.header.size:
+			try:
+				li.seek(offset + self.header.name)
+				name = readasciz(li)
+				self.name = name if str is bytes else name.decode("latin-1")
+			except EOFError:
+				pass
+		self.textsegea = None
+		self.datasegea = None # None if no M$Mem
+		self.segprefix = "" # of segment names
+		self.prefix = "" # of names
+
+# names of modules unique in the file, for segments and symbols; offset is added to duplicated one.
+def modulenames(modules):
+	names = []
+	used = set()
+	for m in modules:
+		name = m.name or "M%X" % m.offset
+		if name in used:
+			name = "%s_%X" % (name, m.offset)
+		used.add(name)
+		names.append(name)
+	return names
+
+# lay modules out one after another: text (whole module), data; like loadseg does.
+def layout(modules):
 	ea = 0
-	textsegea = ea
-	ea = loadseg(".text", ea, header.size, "CODE", li)
-
-	def symbolize(symea, fields):
-		for (name, width) in fields:
-			if width == 1:
-				idaapi.doByte(symea, 1)
-			elif width == 2:
-				idaapi.doWord(symea, 2)
-			elif width == 4:
-				idaapi.doDwrd(symea, 4)
-			else:
-				idaapi.doByte(symea, width)
+	for m in modules:
+		m.textsegea = ea
+		ea = (ea + m.header.size + 15) & -16
+		if m.hmem is not None:
+			m.datasegea = ea
+			ea = (ea + m.hmem + 15) & -16
+
+# make segments, and load module and its initialized data.
+def loadsegments(li, m):
+	# simply map whole to text (using header)
+	li.seek(m.offset)
+	loadseg(m.segprefix + ".text", m.textsegea, m.header.size, "CODE", li)
 
-			if Name is not None:
-				idaapi.set_name(symea, name, idaapi.SN_CHECK)
+	if m.hmem is not None:
+		# make data/bss
+		loadseg(m.segprefix + ".data", m.datasegea, m.hmem, "DATA")
 
-			symea += width
-	# symbolize header
+		if m.hidata is not None:
+			# load data
+			li.seek(m.offset + m.hidata)
+			doff = readl(li)
+			dlen = readl(li)
+			loadbytes(m.datasegea + doff, dlen, li)
+
+# items and names of fields from symea. returns {name: ea}
+def symbolize(symea, fields, prefix=""):
+	eas = {}
+	for (name, width) in fields:
+		if width == 1:
+			idaapi.doByte(symea, 1)
+		elif width == 2:
+			idaapi.doWord(symea, 2)
+		elif width == 4:
+			idaapi.doDwrd(symea, 4)
+		else:
+			idaapi.doByte(symea, width)
+
+		if name is not None:
+			idaapi.set_name(symea, prefix + name, idaapi.SN_CHECK)
+			eas[name] = symea
+
+		symea += width
+	return eas
+
+# module header fields by type
+def headerfields(type):
 	# common
 	fields = [
 		("M$ID", 2),
@@ -200,29 +430,29 @@ def load_file(li, neflags, format):
 	]
 
 	# programmy 0x30-
-	if header.type in [1, 11, 12, 13, 14]: # Prgm, TrapLib, Systm, Flmgr, Drivr
+	if type in [1, 11, 12, 13, 14]: # Prgm, TrapLib, Systm, Flmgr, Drivr
 		fields += [
 			("M$Exec", 4), # Flmgr/Drivr points to entry table.
 			("M$Excpt", 4),
 		]
-	if header.type in [1, 11, 14]: # Prgm, TrapLib, Drivr
+	if type in [1, 11, 14]: # Prgm, TrapLib, Drivr
 		fields += [
 			("M$Mem", 4),
 		]
-	if header.type in [1, 11]: # Prgm, TrapLib
+	if type in [1, 11]: # Prgm, TrapLib
 		fields += [
 			("M$Stack", 4),
 			("M$IData", 4),
 			("M$IRefs", 4),
 		]
-	if header.type in [11]: # TrapLib
+	if type in [11]: # TrapLib
 		fields += [
 			("M$Init", 4),
 			("M$Term", 4),
 		]
 
 	# device-descriptor 0x30-
-	if header.type == 15: # Devic
+	if type == 15: # Devic
 		fields += [
 			("M$Port", 4),
 			("M$Vector", 1),
@@ -236,15 +466,22 @@ def load_file(li, neflags, format):
 			("M$Opt", 2),
 			("M$DTyp", 2),
 		]
+	return fields
+
+def annotatedecbyte(ea, tab):
+	idaapi.op_dec(ea, 0)
+	idaapi.set_cmt(ea, tab.get(idaapi.get_byte(ea)), 1)
+
+# symbolize header, CRC and initialized data table in text
+def symbolizeheader(li, m):
+	textsegea = m.textsegea
+	size = m.header.size
 
 	# go
-	symbolize(textsegea, fields)
+	eas = symbolize(textsegea, headerfields(m.header.type), m.prefix)
 
 	# annotate
-	def annotatedecbyte(ea, tab):
-		idaapi.op_dec(ea, 0)
-		idaapi.set_cmt(ea, tab.get(idaapi.get_byte(ea)), 1)
-	annotatedecbyte(idaapi.get_name_ea(BADADDR, "M$Type"), {
+	annotatedecbyte(eas["M$Type"], {
 		1: "Prgm",
 		2: "Sbrtn",
 		3: "Multi",
@@ -256,7 +493,7 @@ def load_file(li, neflags, format):
 		14: "Drivr",
 		15: "Devic",
 	})
-	annotatedecbyte(idaapi.get_name_ea(BADADDR, "M$Lang"), {
+	annotatedecbyte(eas["M$Lang"], {
 		1: "Objct",
 		2: "ICode",
 		3: "PCode",
@@ -265,110 +502,248 @@ def load_file(li, neflags, format):
 		6: "FtrnCode",
 	})
 
-	idaapi.doByte(textsegea + header.size - 3, 3)
-	idaapi.set_name(textsegea + header.size - 3, "M$CRC", idaapi.SN_CHECK) # coined symbol
+	idaapi.doByte(textsegea + size - 3, 3)
+	idaapi.set_name(textsegea + size - 3, m.prefix + "M$CRC", idaapi.SN_CHECK) # coined symbol
+	try:
+		crc = readcrc(li, m.offset, size - 3).stored()
+		li.seek(m.offset + size - 3)
+		if struct.unpack(">I", b'\0' + read(li, 3))[0] != crc:
+			idaapi.set_cmt(textsegea + size - 3, "CRC mismatch: should be %06X" % crc, 1)
+	except EOFError:
+		idaapi.set_cmt(textsegea + size - 3, "CRC unknown: module is truncated", 1)
+
+	if m.hmem is not None and m.hidata is not None:
+		li.seek(m.offset + m.hidata + 4)
+		dlen = readl(li)
+
+		# symbolize idata in text
+		idaapi.set_name(textsegea + m.hidata, m.prefix + "__data", idaapi.SN_CHECK) # coined symbol
+		idaapi.doDwrd(textsegea + m.hidata, 4)
+		idaapi.doDwrd(textsegea + m.hidata + 4, 4)
+		idaapi.doByte(textsegea + m.hidata + 8, dlen)
+
+# items of M$IRefs table, and its relocations into fixups (ea -> refsegea)
+def symbolizeirefs(li, m, fixups):
+	if m.hirefs is None:
+		return
+	textsegea = m.textsegea
+	idaapi.set_name(textsegea + m.hirefs, m.prefix + "__irefs", idaapi.SN_CHECK) # coined symbol
+
+	# decode whole table from file at once, instead of get_word from database each word.
+	blocks = readirefs(li, m.offset + m.hirefs, m.offset + m.header.size)
+
+	# data->text, data->data
+	for (refsegea, block) in zip([textsegea, m.datasegea], blocks):
+		for (off, msword, lswords) in block:
+			relocea = textsegea + off - m.offset
+			idaapi.doWord(relocea, 2)
+			idaapi.doWord(relocea + 2, 2)
+			if lswords is None:
+				# terminator
+				continue
+			idaapi.doWord(relocea + 4, 2 * len(lswords))
+			for lsword in lswords:
+				fixups[m.datasegea + ((msword << 16) | lsword)] = refsegea
+
+# always 32bit reloc. offset from segment is 0, so values already in .data are left as is.
+def setfixups(fixups):
+	sels = {}
+	fd = idaapi.fixup_data_t()
+	fd.type = idaapi.FIXUP_OFF32
+	fd.off = 0
+	for ea in sorted(fixups):
+		refsegea = fixups[ea]
+		if refsegea not in sels:
+			sels[refsegea] = idaapi.setup_selector(refsegea >> 4)
+		fd.sel = sels[refsegea]
+		idaapi.set_fixup(ea, fd)
+
+def makeOffsetTable(tabea, base, syms, prefix=""):
+	ea = tabea
+	known = set()
+	for sym in syms:
+		idaapi.doWord(ea, 2)
+		idaapi.set_cmt(ea, sym, 1)
+
+		w = idaapi.get_full_word(ea)
+		if w != 0:
+			idaapi.op_offset(ea, 0, idaapi.REF_OFF16 | idaapi.REFINFO_NOBASE, -1, base, 0)
+			addr = base + w
+			idaapi.add_func(addr, idaapi.BADADDR)
+			if addr not in known:
+				known.add(addr)
+				idaapi.set_name(addr, prefix + sym, idaapi.SN_CHECK | idaapi.SN_PUBLIC)
+			else:
+				# delete duplicated name
+				idaapi.set_name(addr, "", 0)
 
-	if hmem is not None:
-		# make data/bss
-		datasegea = ea
-		ea = loadseg(".data", ea, hmem, "DATA")
+		ea += 2
 
-		if hidata is not None:
-			# load data
-			li.seek(hidata)
-			doff = readl(li)
-			dlen = readl(li)
-			loadbytes(datasegea + doff, dlen, li)
-
-			# symbolize idata in text
-			idaapi.set_name(textsegea + hidata, "__data", idaapi.SN_CHECK) # coined symbol
-			idaapi.doDwrd(textsegea + hidata, 4)
-			idaapi.doDwrd(textsegea + hidata + 4, 4)
-			idaapi.doByte(textsegea + hidata + 8, dlen)
-
-	# reloc
-	if hirefs is not None:
-		idaapi.set_name(textsegea + hirefs, "__irefs", idaapi.SN_CHECK) # coined symbol
-
-		def reloc(tgtsegea, tgtoff, refsegea, refoff=None):
-			ea = tgtsegea + tgtoff
-			fd = idaapi.fixup_data_t()
-			fd.sel = idaapi.setup_selector(refsegea >> 4)
-			fd.off = refoff or 0
-
-			# always 32bit reloc
-			fd.type = idaapi.FIXUP_OFF32
-			get = idaapi.get_long
-			put = lambda ea, value: idaapi.put_long(ea, value)
-
-			idaapi.set_fixup(ea, fd)
-			# we manually reloc it... need to make disasseble with offset ok
-			fd.off += get(ea)
-			put(ea, fd.off)
-
-		def reloc_block(relocea, refsegea):
-			while True:
-				idaapi.doWord(relocea, 2)
-				msword = idaapi.get_word(relocea)
-				relocea += 2
+# entry points (ordinal for start and ordinal+1 for trapinit) and entry tables.
+def addentries(m, ordinal):
+	textsegea = m.textsegea
+	type = m.header.type
+	if type in [1, 11, 12]: # Prgm, TrapLib, Systm
+		_makecode = 1
+		idaapi.add_entry(ordinal, textsegea + m.hexec, m.prefix + 'start', _makecode)
 
-				idaapi.doWord(relocea, 2)
-				count = idaapi.get_word(relocea)
-				relocea += 2
+	if type == 13: # Flmgr
+		makeOffsetTable(textsegea + m.hexec, textsegea + m.hexec, ["Create", "Open", "MakDir", "ChgDir", "Delete", "Seek", "Read", "Write", "ReadLn", "WriteLn", "GetStat", "SetStat", "Close"], m.prefix)
 
-				if msword == 0 and count == 0:
-					return relocea
+	if type == 14: # Drivr
+		makeOffsetTable(textsegea + m.hexec, textsegea, ["Init", "Read", "Write", "GetStat", "SetStat", "TrmNat", "Error"], m.prefix)
+
+	if m.hexcpt != 0 and type in [1, 11, 12, 13, 14]: # Prgm, TrapLib, Systm, Flmgr, Drivr
+		_makecode = 1
+		idaapi.add_entry(ordinal + 1, textsegea + m.hexcpt, m.prefix + 'trapinit', _makecode)
 
-				idaapi.doWord(relocea, 2 * count)
-				for _ in xrange(count):
-					lsword = idaapi.get_word(relocea)
-					relocea += 2
+	# TODO: add_entry init/term on header.type==11?
 
-					reloc(datasegea, (msword << 16) | lsword, refsegea)
+# Chooser of modules in a boot file. choosing a module toggles it, choosing the first line loads checked ones.
+class ModuleSelector(Choose2):
+	TYPES = {1: "Prgm", 2: "Sbrtn", 3: "Multi", 4: "Data", 5: "CSDData", 11: "TrapLib", 12: "Systm", 13: "Flmgr", 14: "Drivr", 15: "Devic"}
+
+	def __init__(self, modules):
+		title = "Choose modules to load"
+		cols = [
+			["Load",    3 | idaapi.Choose2.CHCOL_PLAIN],
+			["Offset",  6 | idaapi.Choose2.CHCOL_HEX],
+			["Name",   16 | idaapi.Choose2.CHCOL_PLAIN],
+			["Type",    7 | idaapi.Choose2.CHCOL_PLAIN],
+			["Size",    6 | idaapi.Choose2.CHCOL_HEX],
+			["Ed",      3 | idaapi.Choose2.CHCOL_DEC],
+		]
+		idaapi.Choose2.__init__(self, title, cols)
+		self.modules = modules
+		self.checked = [False] * len(modules)
+
+	def OnGetSize(self):
+		return 1 + len(self.modules)
+
+	def OnGetLine(self, n):
+		if n == 0:
+			return ["", "", "(load %d checked)" % sum(self.checked), "", "", ""]
+		m = self.modules[n - 1]
+		return [
+			"*" if self.checked[n - 1] else "",
+			hex(m.offset),
+			m.name or "?",
+			self.TYPES.get(m.header.type, str(m.header.type)),
+			hex(m.header.size),
+			str(m.header.edit),
+		]
 
-		relocea = textsegea + hirefs
-		# data->text
-		relocea = reloc_block(relocea, textsegea)
-		# data->data
-		relocea = reloc_block(relocea, datasegea)
+	def OnClose(self):
+		pass
 
-	if header.type in [1, 11, 12]: # Prgm, TrapLib, Systm
-		_entryord = 0
-		_makecode = 1
-		idaapi.add_entry(_entryord, hexec, 'start', _makecode)
-
-	def makeOffsetTable(tabea, base, syms):
-		ea = tabea
-		known = set()
-		for sym in syms:
-			idaapi.doWord(ea, 2)
-			idaapi.set_cmt(ea, sym, 1)
-
-			w = idaapi.get_full_word(ea)
-			if w != 0:
-				idaapi.op_offset(ea, 0, idaapi.REF_OFF16 | idaapi.REFINFO_NOBASE, -1, base, 0)
-				addr = base + w
-				idaapi.add_func(addr, idaapi.BADADDR)
-				if addr not in known:
-					known.add(addr)
-					idaapi.set_name(addr, sym, idaapi.SN_CHECK | idaapi.SN_PUBLIC)
-				else:
-					# delete duplicated name
-					idaapi.set_name(addr, "", 0)
-
-			ea += 2
-
-	if header.type == 13: # Flmgr
-		makeOffsetTable(hexec, hexec, ["Create", "Open", "MakDir", "ChgDir", "Delete", "Seek", "Read", "Write", "ReadLn", "WriteLn", "GetStat", "SetStat", "Close"])
-
-	if header.type == 14: # Drivr
-		makeOffsetTable(hexec, textsegea, ["Init", "Read", "Write", "GetStat", "SetStat", "TrmNat", "Error"])
-
-	if hexcpt != 0 and header.type in [1, 11, 12, 13, 14]: # Prgm, TrapLib, Systm, Flmgr, Drivr
-		_entryord = 1
-		_makecode = 1
-		idaapi.add_entry(_entryord, hexcpt, 'trapinit', _makecode)
+	# checked modules, or None if cancelled
+	def show(self):
+		while True:
+			i = self.Show(True)
+			if i == -1:
+				return None
+			if i == 0:
+				return [m for (m, checked) in zip(self.modules, self.checked) if checked]
+			self.checked[i - 1] = not self.checked[i - 1]
 
-	# TODO: add_entry init/term on header.type==11?
+def load_file(li, neflags, format):
+	# hey wrong man
+	if format not in [FORMAT_EXE, FORMAT_EXE_BADCRC, FORMAT_BOOT, FORMAT_BOOT_SELECT]:
+		return 0
+
+	# requires 68000 processor module. (should be 68070 for CD-i)
+	idaapi.set_processor_type('68000', SETPROC_ALL | SETPROC_FATAL)
+
+	# rewind
+	li.seek(0)
+
+	boot = format in [FORMAT_BOOT, FORMAT_BOOT_SELECT]
+	if not boot:
+		offsets = [0]
+	else:
+		offsets = walkchain(li)
+		if format == FORMAT_BOOT_SELECT:
+			chosen = ModuleSelector([Module(li, offset) for offset in offsets]).show()
+			if not chosen:
+				# cancel
+				return 0
+			offsets = [m.offset for m in chosen]
+		# which ones are part of the key
+		format = "%s %s" % (format, ",".join(["%X" % offset for offset in offsets]))
+
+	load = lambda li: load_modules(li, offsets, boot)
+	if os9cache is None:
+		li.seek(0)
+		modules = load(li)
+	else:
+		modules = os9cache.load(sys.modules[__name__], "os9x", PLANVERSION, format, li, 0, li.size(), load)
+	if modules is None:
+		return 0
+
+	matchlibrary(li, modules)
 
 	return 1
+
+# bump when what load_modules writes changes; cached load plans of other versions are not used.
+PLANVERSION = 2
+
+# load modules at offsets of li, each pass over all of them. names are prefixed by module name if prefixed.
+# returns [(file offset, text ea, size)] of modules.
+def load_modules(li, offsets, prefixed):
+	start = time.time()
+	modules = [Module(li, offset) for offset in offsets]
+	if prefixed:
+		for (m, name) in zip(modules, modulenames(modules)):
+			m.segprefix = name + ":"
+			m.prefix = name + "_"
+
+	layout(modules)
+	for m in modules:
+		loadsegments(li, m)
+	for m in modules:
+		symbolizeheader(li, m)
+	fixups = {} # ea -> refsegea; latter one wins as set_fixup does.
+	for m in modules:
+		symbolizeirefs(li, m, fixups)
+	setfixups(fixups)
+	for (i, m) in enumerate(modules):
+		addentries(m, 2 * i)
+
+	if prefixed:
+		print("os9x: %d modules, %d fixups, loaded in %.3fs" % (len(modules), len(fixups), time.time() - start))
+
+	return [(m.offset, m.textsegea, m.header.size) for m in modules]
+
+# validate modules at top of files.
+def main(args):
+	if not args:
+		print("usage: %s FILE..." % sys.argv[0], file=sys.stderr)
+		return 2
+
+	bad = 0
+	total = 0
+	start = time.time()
+	for path in args:
+		with open(path, "rb") as f:
+			head = f.read(48)
+			if len(head) < 48 or head[0:2] != b'\x4A\xFC':
+				status = "not a module"
+			elif parity(head) != 0:
+				status = "BAD parity"
+			else:
+				size = struct.unpack_from(">I", head, 4)[0]
+				try:
+					crc = readcrc(f, 0, size).crc
+					total += size
+					status = "OK" if crc == CRC_GOOD else "BAD CRC"
+				except EOFError:
+					status = "BAD truncated"
+		if status != "OK":
+			bad += 1
+		print("%s: %s" % (path, status))
+	elapsed = time.time() - start
+	print("%d files, %d bad, %d bytes checked in %.3fs (%.2f MB/s)" % (len(args), bad, total, elapsed, total / 1e6 / max(elapsed, 1e-9)), file=sys.stderr)
+	return 1 if bad else 0
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))